@@ -0,0 +1,201 @@
+import os
+import asyncio
+import time
+from collections import deque, Counter
+from contextlib import asynccontextmanager
+from inference_pool import INFERENCE_WORKERS, INFERENCE_THREADS, INFERENCE_QUEUE_SIZE
+from session_state import SESSION_IDLE_CLOSE
+
+# -------------------------
+# Config
+# -------------------------
+# Frames admitted to inference at once (0 = two per worker thread, at most INFERENCE_QUEUE_SIZE)
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", 0)) or min(
+    INFERENCE_QUEUE_SIZE, 2 * max(INFERENCE_WORKERS, 1) * INFERENCE_THREADS)
+ADMISSION_PER_CANDIDATE = int(os.getenv("ADMISSION_PER_CANDIDATE", 1))   # frames of one candidate in inference at once
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 1.0))         # seconds a frame may wait for a slot before it is stale
+CAPTURE_INTERVAL_MS = int(os.getenv("CAPTURE_INTERVAL_MS", 2000))        # client capture interval when the server is not loaded
+CAPTURE_INTERVAL_MAX_MS = int(os.getenv("CAPTURE_INTERVAL_MAX_MS", 10000))  # ... and at full load
+ADMISSION_TARGET_LOAD = float(os.getenv("ADMISSION_TARGET_LOAD", 0.5))   # load above which clients are slowed down
+ADMISSION_SHED_WINDOW = float(os.getenv("ADMISSION_SHED_WINDOW", 10.0))  # seconds a shed frame keeps the hint at full load
+
+if CAPTURE_INTERVAL_MAX_MS >= SESSION_IDLE_CLOSE * 1000:
+    print(f"[admission] CAPTURE_INTERVAL_MAX_MS ({CAPTURE_INTERVAL_MAX_MS} ms) is not below SESSION_IDLE_CLOSE "
+          f"({SESSION_IDLE_CLOSE} s): slowed-down candidates will have their episodes closed between frames")
+
+
+class FrameShed(Exception):
+    """
+    A frame was not admitted to inference. `reason` is "superseded" (a newer
+    frame of the same candidate arrived while it waited), "stale" (no slot
+    within ADMISSION_MAX_WAIT) or "overloaded" (no slot and waiting disabled).
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Candidate:
+    __slots__ = ("inflight", "waiting")
+
+    def __init__(self):
+        self.inflight = 0
+        self.waiting = None  # future of the candidate's frame waiting for a slot
+
+
+class AdmissionControl:
+    """
+    Decides which frames reach the inference pool, so latency stays bounded
+    when more candidates send frames than the workers can analyze.
+
+    At most `max_inflight` frames run in total and `per_candidate` per
+    candidate. A frame that finds no slot waits up to `max_wait` seconds,
+    one per candidate: a newer frame of the same candidate replaces the
+    waiting one (the old frame would only report a stale picture), and
+    a frame still waiting after `max_wait` is dropped. Slots are handed
+    out in arrival order.
+
+    `next_interval_ms()` turns the current load into the capture interval
+    clients are asked to use, so under overload they sample less often
+    instead of piling up frames that would be shed anyway.
+
+    Used from the event loop only, so no locking.
+    """
+
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT, per_candidate: int = ADMISSION_PER_CANDIDATE,
+                 max_wait: float = ADMISSION_MAX_WAIT, interval_ms: int = CAPTURE_INTERVAL_MS,
+                 max_interval_ms: int = CAPTURE_INTERVAL_MAX_MS, target_load: float = ADMISSION_TARGET_LOAD,
+                 shed_window: float = ADMISSION_SHED_WINDOW):
+        self.max_inflight = max(1, max_inflight)
+        self.per_candidate = max(1, per_candidate)
+        self.max_wait = max_wait
+        self.interval_ms = interval_ms
+        self.max_interval_ms = max(interval_ms, max_interval_ms)
+        self.target_load = min(max(target_load, 0.0), 0.99)
+        self.shed_window = shed_window
+
+        self.inflight = 0
+        self.waiting = 0
+        self._candidates = {}       # candidate_id -> _Candidate
+        self._queue = deque()       # (candidate_id, future) in arrival order; done futures are skipped
+        self._last_shed = 0.0
+
+        self.admitted = 0
+        self.shed = Counter()       # reason -> frames
+
+    # -------------------------
+    # Admission
+    # -------------------------
+    @asynccontextmanager
+    async def admit(self, candidate_id: str):
+        """Hold an inference slot for the block, or raise FrameShed."""
+        await self._acquire(candidate_id)
+        try:
+            yield
+        finally:
+            self._release(candidate_id)
+
+    async def _acquire(self, candidate_id: str):
+        state = self._candidates.get(candidate_id)
+        if state is None:
+            state = self._candidates[candidate_id] = _Candidate()
+        if state.waiting is not None and not state.waiting.done():
+            state.waiting.set_exception(FrameShed("superseded"))
+
+        # Frames still waiting are blocked by their own candidate's limit whenever a global slot is free
+        if self._has_room(state):
+            self._take(state)
+            return
+        if self.max_wait <= 0:
+            self._forget(candidate_id, state)
+            raise self._shed("overloaded")
+
+        fut = asyncio.get_running_loop().create_future()
+        state.waiting = fut
+        self._queue.append((candidate_id, fut))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(fut, self.max_wait)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                return  # granted just as the wait ran out: the slot is ours
+            raise self._shed("stale")
+        except FrameShed as e:
+            raise self._shed(e.reason)
+        finally:
+            self.waiting -= 1
+            if state.waiting is fut:
+                state.waiting = None
+            self._forget(candidate_id, state)
+
+    def _has_room(self, state):
+        return self.inflight < self.max_inflight and state.inflight < self.per_candidate
+
+    def _take(self, state):
+        self.inflight += 1
+        state.inflight += 1
+        self.admitted += 1
+
+    def _release(self, candidate_id: str):
+        state = self._candidates[candidate_id]
+        self.inflight -= 1
+        state.inflight -= 1
+        self._forget(candidate_id, state)
+        self._grant()
+
+    def _grant(self):
+        """Hand freed slots to waiting frames, oldest first, skipping candidates already at their limit."""
+        blocked = []
+        while self._queue and self.inflight < self.max_inflight:
+            candidate_id, fut = self._queue.popleft()
+            if fut.done():  # superseded or timed out
+                continue
+            state = self._candidates[candidate_id]
+            if not self._has_room(state):
+                blocked.append((candidate_id, fut))
+                continue
+            self._take(state)
+            fut.set_result(None)
+        self._queue.extendleft(reversed(blocked))
+
+    def _forget(self, candidate_id: str, state):
+        if not state.inflight and state.waiting is None:
+            self._candidates.pop(candidate_id, None)
+
+    def _shed(self, reason: str):
+        self.shed[reason] += 1
+        if reason != "superseded":  # a candidate outpacing its own frames is not server overload
+            self._last_shed = time.monotonic()
+        return FrameShed(reason)
+
+    # -------------------------
+    # Client pacing
+    # -------------------------
+    @property
+    def load(self):
+        """Slots in use plus frames waiting for one, relative to the slot count (can exceed 1)."""
+        return (self.inflight + self.waiting) / self.max_inflight
+
+    def next_interval_ms(self):
+        """
+        Capture interval for clients: the normal interval up to `target_load`,
+        then growing linearly to the maximum at full load. For `shed_window`
+        seconds after a frame was shed the maximum is returned regardless.
+        """
+        if time.monotonic() - self._last_shed < self.shed_window:
+            return self.max_interval_ms
+        excess = (self.load - self.target_load) / (1.0 - self.target_load)
+        excess = min(max(excess, 0.0), 1.0)
+        return int(self.interval_ms + (self.max_interval_ms - self.interval_ms) * excess)
+
+    def stats(self):
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "per_candidate": self.per_candidate,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "next_interval_ms": self.next_interval_ms(),
+        }
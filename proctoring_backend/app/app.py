@@ -1,12 +1,24 @@
-from fastapi import FastAPI, Request, File, UploadFile
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request, File, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-import base64, io, cv2, numpy as np
-from detection import analyze_frame
-from db import insert_event, get_events
-import pandas as pd
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+from fastapi.encoders import jsonable_encoder
+import base64, queue, json, asyncio, time, threading, math
+from bson.errors import InvalidId
+from fastapi.concurrency import run_in_threadpool
+from db import parse_cursor, ZERO_CURSOR, LOG_SETTLE_MS, init_db
+from async_db import get_events, get_events_since, get_log_cursor, get_summary, get_video_job, ping
+import async_db
+from pymongo.errors import PyMongoError
+from event_writer import event_writer
+from log_stream import log_broadcaster
+from metrics import (registry, stage_seconds, frames_total, events_total, request_seconds,
+                     METRICS_ENABLED, PROFILE_REQUESTS)
+from inference_pool import InferencePool, PoolBusy
+from admission import AdmissionControl, FrameShed
+from reports import pdf_report, stream_csv, cached_report
+from uploads import (UPLOAD_DIR, UploadError, safe_filename, upload_path, save_stream, iter_upload_file,
+                     init_upload, get_upload, append_chunk, finalize_upload)
+from video_analysis import queue_job, job_id_for, POSTHOC_SAMPLE_FPS, POSTHOC_CHUNK_SECONDS
 import os
 
 app = FastAPI(title="Proctoring API (Browser Upload)")
@@ -17,85 +29,429 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Detection runs in a pool of worker processes, never on the event loop
+inference_pool = InferencePool()
+
+def store_closed_episodes(candidate_id: str, records: list):
+    """
+    Episodes the pool closed without a frame (the candidate stopped sending,
+    or shutdown). Runs on the pool's result thread, so it never waits for room
+    in the writer's buffer: what does not fit is dropped and counted.
+    """
+    for rec in records:
+        events_total.inc(type=rec.get("type", ""), status=rec.get("status", ""))
+        event_writer.submit(candidate_id, rec, timeout=0)
+
+inference_pool.on_episodes_closed = store_closed_episodes
+
+# Bounds the frames reaching the pool (globally and per candidate), drops
+# stale ones and tells clients how often to capture (admission.py)
+admission = AdmissionControl()
+
+# Push new detections to /logs stream subscribers as soon as they are written
+event_writer.add_listener(log_broadcaster.notify)
+
+# Queue depths are read when /metrics is scraped
+registry.gauge("proctoring_inference_queue_depth", "Frames queued or running in the inference pool",
+               lambda: inference_pool.queue_depth)
+registry.gauge("proctoring_inference_worker_depth", "Frames queued or running per inference worker",
+               lambda: dict(enumerate(inference_pool.stats()["per_worker_depth"])), labelname="worker")
+registry.gauge("proctoring_inference_ready_workers", "Inference workers with models loaded",
+               lambda: inference_pool.ready_workers)
+registry.gauge("proctoring_admission_inflight", "Frames admitted to inference and not finished",
+               lambda: admission.inflight)
+registry.gauge("proctoring_admission_waiting", "Frames waiting for an inference slot",
+               lambda: admission.waiting)
+registry.gauge("proctoring_capture_interval_ms", "Capture interval currently suggested to clients",
+               admission.next_interval_ms)
+registry.gauge("proctoring_event_queue_depth", "Events buffered for the Mongo writer",
+               lambda: event_writer.stats()["queued"])
+registry.gauge("proctoring_log_subscribers", "Open /logs streams", log_broadcaster.subscriber_count)
+LOGS_STREAM_KEEPALIVE = 15  # seconds; also how often a stream re-checks for events written by other processes
+LOGS_STREAM_BATCH = 500
+
+READY_DB_TIMEOUT = 2.0  # seconds /readyz waits for a Mongo ping
+
+@app.on_event("startup")
+def start_inference_pool():
+    # Returns at once: workers load and warm up their models in the background (see /readyz)
+    inference_pool.start()
+
+@app.on_event("startup")
+def start_database_init():
+    # Collections and indexes are set up in the background; a request that
+    # needs them first simply does it itself (db.init_db is idempotent)
+    def init():
+        try:
+            init_db()
+        except PyMongoError as e:
+            print(f"[startup] database not ready yet: {e}")
+    threading.Thread(target=init, name="db-init", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_inference_pool():
+    inference_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_event_writer():
+    event_writer.close()
+
+@app.on_event("shutdown")
+async def close_database():
+    await async_db.close()
+
+@app.exception_handler(PyMongoError)
+async def database_unavailable(request: Request, e: PyMongoError):
+    # Timeouts and lost connections answer 503 quickly instead of hanging the request
+    print(f"[db] {request.method} {request.url.path} failed: {e!r}")
+    return JSONResponse(status_code=503, content={"error": "Database unavailable, try again"})
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    if not METRICS_ENABLED:
+        return await call_next(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template, not the raw path, so candidate ids do not become labels
+        route = request.scope.get("route")
+        request_seconds.observe(time.perf_counter() - start, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=status)
+
+async def log_events(candidate_id: str, events: list):
+    """
+    Queue events for the buffered writer; only waits (off the event loop, at
+    most EVENT_SUBMIT_TIMEOUT per frame) when its buffer is full. Events that
+    still do not fit are dropped and counted by the writer.
+    """
+    gave_up = False
+    for ev in events:
+        events_total.inc(type=ev.get("type", ""), status=ev.get("status", ""))
+        try:
+            event_writer.submit(candidate_id, ev, block=False)
+        except queue.Full:
+            if gave_up:  # the buffer stayed full for a whole timeout: drop the rest of the frame's events
+                event_writer.submit(candidate_id, ev, timeout=0)
+            else:
+                gave_up = not await run_in_threadpool(event_writer.submit, candidate_id, ev)
+
 @app.get("/")
 def root():
     return {"message": "Proctoring API running"}
 
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests (no dependency checks)."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: Mongo answers and every inference worker has its models loaded and warmed up."""
+    checks = {
+        "database": await ping(READY_DB_TIMEOUT),
+        "inference": inference_pool.ready,
+    }
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"status": "ready" if ready else "not ready", "checks": checks,
+                                 "ready_workers": inference_pool.ready_workers,
+                                 "workers": max(inference_pool.workers, 1)})
+
+# Analyze uploaded recordings in a background process (video_analysis.py)
+POSTHOC_ON_UPLOAD = os.getenv("POSTHOC_ON_UPLOAD", "0") == "1"
+
 @app.post("/upload_video")
 async def upload_video(candidate_id: str = None, file: UploadFile = File(...)):
-    save_dir = "videos"
-    os.makedirs(save_dir, exist_ok=True)
-    filename = file.filename if file.filename else f"{candidate_id}_video.webm"
-    file_path = os.path.join(save_dir, filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    return {"message": "Video uploaded", "path": file_path}
+    """Single-request upload, copied to disk UPLOAD_CHUNK_SIZE bytes at a time."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    try:
+        file_path = upload_path(safe_filename(file.filename, f"{candidate_id}_video.webm"))
+    except UploadError as e:
+        return upload_error(e)
+    await save_stream(iter_upload_file(file), file_path)
+    return {"message": "Video uploaded", "path": file_path, **start_posthoc(file_path, candidate_id)}
+
+def start_posthoc(file_path: str, candidate_id: str):
+    if POSTHOC_ON_UPLOAD and candidate_id:
+        job_id = job_id_for(file_path, candidate_id, POSTHOC_SAMPLE_FPS, POSTHOC_CHUNK_SECONDS)
+        return {"job_id": job_id, "jobs_ahead": queue_job(file_path, candidate_id)}
+    return {}
+
+def upload_error(e: UploadError):
+    return JSONResponse(status_code=e.status_code, content={"error": str(e), **e.extra})
+
+# Resumable uploads: POST /uploads -> PUT /uploads/{id}?offset=N (raw chunk) -> POST /uploads/{id}/finalize
+@app.post("/uploads")
+async def create_upload(request: Request):
+    data = await request.json()
+    candidate_id = data.get("candidate_id")
+    if not candidate_id:
+        return JSONResponse(status_code=400, content={"error": "candidate_id required"})
+    try:
+        return init_upload(candidate_id, data.get("filename"), data.get("size"))
+    except UploadError as e:
+        return upload_error(e)
+
+@app.get("/uploads/{upload_id}")
+def upload_status(upload_id: str):
+    """Where to resume: `offset` is the number of bytes already stored."""
+    try:
+        return get_upload(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Body is the raw chunk; optional X-Chunk-SHA256 header is verified."""
+    try:
+        new_offset = await append_chunk(upload_id, offset, request.stream(),
+                                        request.headers.get("x-chunk-sha256"))
+    except UploadError as e:
+        return upload_error(e)
+    return {"upload_id": upload_id, "offset": new_offset}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize(upload_id: str, request: Request):
+    data = await request.json() if await request.body() else {}
+    try:
+        meta, file_path, digest = await finalize_upload(upload_id, data.get("size"), data.get("sha256"))
+    except UploadError as e:
+        return upload_error(e)
+    return {"message": "Video uploaded", "path": file_path, "sha256": digest,
+            **start_posthoc(file_path, meta["candidate_id"])}
+
+@app.get("/video_jobs/{job_id}")
+async def video_job(job_id: str):
+    """Progress of a recorded-video analysis job."""
+    job = await get_video_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return jsonable_encoder(job)
 
 @app.post("/analyze")
-async def analyze(req: Request):
+async def analyze(req: Request, profile: bool = False):
     """
     Candidate sends webcam frame (base64) + candidate_id.
     We run YOLO+MediaPipe and log suspicious events.
     """
-    data = await req.json()
+    with stage_seconds.time(stage="read_body"):
+        data = await req.json()
     candidate_id = data["candidate_id"]
     frame_data = data["frame"]
 
-    # Decode base64 -> numpy image
-    img_bytes = base64.b64decode(frame_data.split(",")[1])
-    np_arr = np.frombuffer(img_bytes, np.uint8)
-    frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    # Decode base64 -> JPEG bytes (the worker decodes the image)
+    with stage_seconds.time(stage="base64"):
+        img_bytes = base64.b64decode(frame_data.split(",")[1])
+    return await analyze_bytes(candidate_id, img_bytes, profile)
 
-    # Run detection
-    events = analyze_frame(frame)
-    for ev in events:
-        insert_event(candidate_id, ev)
+@app.post("/analyze/raw")
+async def analyze_raw(candidate_id: str, req: Request, profile: bool = False):
+    """
+    Same as /analyze, but the body is the raw JPEG (application/octet-stream
+    or image/jpeg) and candidate_id is a query parameter. No base64, no JSON.
+    """
+    with stage_seconds.time(stage="read_body"):
+        img_bytes = await req.body()
+    if not img_bytes:
+        frames_total.inc(result="invalid")
+        return JSONResponse(status_code=400, content={"error": "empty frame"})
+    return await analyze_bytes(candidate_id, img_bytes, profile)
+
+@app.websocket("/ws/analyze/{candidate_id}")
+async def analyze_ws(websocket: WebSocket, candidate_id: str):
+    """
+    Persistent per-candidate stream: every binary message is one JPEG frame,
+    every reply is the JSON result for that frame. A text message closes the
+    socket with 1003 (unsupported data).
+    """
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            img_bytes = message.get("bytes")
+            if img_bytes is None:
+                frames_total.inc(result="invalid")
+                await websocket.close(code=1003, reason="frames must be binary messages")
+                break
+            result = await analyze_bytes(candidate_id, img_bytes)
+            if isinstance(result, JSONResponse):
+                await websocket.send_text(result.body.decode())
+            else:
+                await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
+
+async def analyze_bytes(candidate_id: str, img_bytes: bytes, profile: bool = False):
+    """
+    Run detection on encoded frame bytes and log the events. Frames the
+    admission control sheds get a 429/503 instead; either way the response
+    has `next_interval_ms`, the capture interval the client should use next.
+    With `profile` (and PROFILE_REQUESTS=1) the response includes a sampled
+    profile of the frame's analysis.
+    """
+    sampled = {} if profile and PROFILE_REQUESTS else None
+    try:
+        async with admission.admit(candidate_id):
+            with stage_seconds.time(stage="inference"):
+                events = await inference_pool.submit(candidate_id, img_bytes, profile=sampled)
+    except FrameShed as e:
+        frames_total.inc(result=f"shed_{e.reason}")
+        # superseded: this candidate already sent a newer frame; otherwise the server is saturated
+        return frame_dropped(429 if e.reason == "superseded" else 503, f"Frame dropped ({e.reason})")
+    except PoolBusy:
+        frames_total.inc(result="busy")
+        return frame_dropped(503, "Server busy, frame dropped")
+    except (asyncio.TimeoutError, RuntimeError) as e:
+        # Inference timed out, or the worker failed or exited: the next frame may well succeed
+        frames_total.inc(result="error")
+        return frame_dropped(503, f"Frame not analyzed: {str(e) or 'inference timed out'}")
+    except ValueError as e:
+        frames_total.inc(result="invalid")
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception:
+        frames_total.inc(result="error")
+        raise
+    frames_total.inc(result="ok")
+    with stage_seconds.time(stage="log_events"):
+        await log_events(candidate_id, events)
+
+    result = {"events_detected": len(events), "queue_depth": inference_pool.queue_depth,
+              "next_interval_ms": admission.next_interval_ms()}
+    if sampled is not None:
+        result["profile"] = sampled
+    return result
+
+def frame_dropped(status: int, error: str):
+    """Refusal for a frame that was not analyzed; carries the capture interval the client should back off to."""
+    interval = admission.next_interval_ms()
+    return JSONResponse(status_code=status, headers={"Retry-After": str(math.ceil(interval / 1000))},
+                        content={"error": error, "queue_depth": inference_pool.queue_depth,
+                                 "next_interval_ms": interval})
 
-    return {"events_detected": len(events)}
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of the counters, histograms and gauges in metrics.py."""
+    if not METRICS_ENABLED:
+        return JSONResponse(status_code=404, content={"error": "metrics disabled"})
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/inference/stats")
+def inference_stats():
+    return {**inference_pool.stats(), "admission": admission.stats(), "event_writer": event_writer.stats(),
+            "log_subscribers": log_broadcaster.subscriber_count()}
 
 @app.get("/logs/{candidate_id}")
-def logs(candidate_id: str, limit: int = 100):
-    events = get_events(candidate_id, limit)
-    return JSONResponse(content={"events": events})
+async def logs(candidate_id: str, request: Request, limit: int = 100, since: str = None):
+    """
+    Without `since`: the `limit` most recent events. With `since` (the `cursor`
+    of a previous response): only events created or updated after it.
+    The ETag names the log state the page covers (latest change and `limit`,
+    or the cursor a complete since-page ends at), so polling an unchanged
+    log with If-None-Match answers an empty 304. Truncated since-pages carry
+    no ETag: the client must fetch the rest.
+    """
+    if since:
+        try:
+            events, cursor = await get_events_since(candidate_id, since, limit)
+        except (ValueError, InvalidId):
+            return JSONResponse(status_code=400, content={"error": "invalid cursor"})
+        if len(events) >= limit:
+            return JSONResponse(content={"events": events, "cursor": cursor})
+        etag = f'"{cursor}"'
+        if not events and request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(content={"events": events, "cursor": cursor}, headers={"ETag": etag})
+
+    latest = await get_log_cursor(candidate_id) or ZERO_CURSOR
+    etag = f'"{latest}/{limit}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    events = await get_events(candidate_id, limit)
+    return JSONResponse(content={"events": events, "cursor": latest}, headers={"ETag": etag})
+
+@app.get("/logs/{candidate_id}/stream")
+async def logs_stream(candidate_id: str, request: Request, since: str = None):
+    """
+    Server-Sent Events: every `events` message carries the events created or
+    updated since the previous one. Starts from `since` / Last-Event-ID, or
+    from the current end of the log.
+    """
+    cursor = since or request.headers.get("last-event-id")
+    if cursor:
+        try:
+            parse_cursor(cursor)
+        except (ValueError, InvalidId):
+            return JSONResponse(status_code=400, content={"error": "invalid cursor"})
+    else:
+        cursor = await get_log_cursor(candidate_id) or ZERO_CURSOR
+
+    async def stream():
+        nonlocal cursor
+        entry = log_broadcaster.subscribe(candidate_id)
+        wake = entry[1]
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                wake.clear()
+                events, cursor = await get_events_since(candidate_id, cursor, LOGS_STREAM_BATCH)
+                if events:
+                    data = json.dumps({"events": events, "cursor": cursor})
+                    yield f"id: {cursor}\nevent: events\ndata: {data}\n\n"
+                    if len(events) == LOGS_STREAM_BATCH:
+                        continue
+                else:
+                    yield ": keepalive\n\n"
+                if await request.is_disconnected():
+                    break
+                try:
+                    await asyncio.wait_for(wake.wait(), LOGS_STREAM_KEEPALIVE)
+                    await asyncio.sleep(LOG_SETTLE_MS / 1000)  # fresh changes are only served once settled
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            log_broadcaster.unsubscribe(candidate_id, entry)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/summary/{candidate_id}")
+async def summary(candidate_id: str):
+    """Running totals by event type (pre-aggregated on write)."""
+    return await get_summary(candidate_id)
 
 @app.get("/report/{candidate_id}")
-def report(candidate_id: str):
-    events = get_events(candidate_id, limit=10000)
-    if not events:
+async def report(candidate_id: str):
+    cursor = await get_log_cursor(candidate_id)
+    if cursor is None:
         return {"message": "No events found"}
+    # Rendered once per log state, then served from the report cache
+    path = await run_in_threadpool(pdf_report, candidate_id, cursor)
+    return FileResponse(path, media_type="application/pdf", filename=f"{candidate_id}_report.pdf")
 
-    # Export CSV
-    df = pd.DataFrame(events)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-
-    # Generate PDF
-    pdf_buffer = io.BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=letter)
-    c.setFont("Helvetica", 12)
-    c.drawString(40, 750, f"Proctoring Report - Candidate: {candidate_id}")
-    c.drawString(40, 735, f"Total events: {len(events)}")
-    y = 710
-    for ev in reversed(events):
-        text = f"{ev.get('timestamp','')} | {ev.get('type','')} | {ev.get('details','')}"
-        c.drawString(40, y, text[:100])
-        y -= 15
-        if y < 60:
-            c.showPage()
-            c.setFont("Helvetica", 12)
-            y = 750
-    c.save()
-    pdf_buffer.seek(0)
-
+@app.get("/report/{candidate_id}/csv")
+async def report_csv(candidate_id: str):
+    cursor = await get_log_cursor(candidate_id)
+    if cursor is None:
+        return {"message": "No events found"}
+    path = cached_report(candidate_id, cursor, "csv")
+    if path:
+        return FileResponse(path, media_type="text/csv", filename=f"{candidate_id}_report.csv")
     return StreamingResponse(
-        pdf_buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={candidate_id}_report.pdf"}
+        stream_csv(candidate_id, cursor),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={candidate_id}_report.csv"}
     )
 from fastapi import Request
-from db import create_candidate, authenticate_candidate, create_interviewer, authenticate_interviewer
+from async_db import create_candidate, authenticate_candidate, create_interviewer, authenticate_interviewer
 
 @app.post("/register")
 async def register(request: Request):
@@ -108,12 +464,12 @@ async def register(request: Request):
     if not username or not password:
         return JSONResponse(status_code=400, content={"error": "username & password required"})
     if role == "interviewer":
-        interviewer = create_interviewer(username, password, name, email)
+        interviewer = await create_interviewer(username, password, name, email)
         if not interviewer:
             return JSONResponse(status_code=400, content={"error": "User already exists"})
         return {"message": "Registration successful", "interviewer_id": interviewer["id"], "name": interviewer["name"]}
     else:
-        candidate = create_candidate(username, password, name, email)
+        candidate = await create_candidate(username, password, name, email)
         if not candidate:
             return JSONResponse(status_code=400, content={"error": "User already exists"})
         return {"message": "Registration successful", "candidate_id": candidate["id"], "name": candidate["name"]}
@@ -125,12 +481,12 @@ async def login(request: Request):
     password = data.get("password")
     role = data.get("role", "candidate")
     if role == "interviewer":
-        interviewer = authenticate_interviewer(username, password)
+        interviewer = await authenticate_interviewer(username, password)
         if not interviewer:
             return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
         return {"message": "Login successful", "interviewer_id": interviewer["id"], "name": interviewer["name"]}
     else:
-        candidate = authenticate_candidate(username, password)
+        candidate = await authenticate_candidate(username, password)
         if not candidate:
             return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
         return {"message": "Login successful", "candidate_id": candidate["id"], "name": candidate["name"]}
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+import db
+from db import (MONGO_URI, MONGO_TIMEOUT_MS, CLIENT_OPTIONS, USER_PROJECTION, _serialize, make_cursor,
+                events_query, log_cursor_query, events_since_query, format_summary, credentials_filter,
+                user_info, new_user_doc)
+
+# The queries behind the API routes, run on an async client so a slow Mongo
+# only delays the requests waiting on it, never the event loop. Filters,
+# sorts and projections are built in db.py. Every operation has a
+# MONGO_TIMEOUT_MS deadline and raises PyMongoError when it cannot be met
+# (app.py answers 503). Writes from the detection hot path go through
+# event_writer, which runs in its own thread.
+
+_client = None
+
+
+def get_database():
+    """The shared async client's database, created on first use (inside the running event loop)."""
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(MONGO_URI, timeoutMS=MONGO_TIMEOUT_MS or None, **CLIENT_OPTIONS)
+    return _client[db.db.name]
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def uses_db(fn):
+    """Make sure db.init_db() (collections and indexes) has run; it is synchronous, so off the loop."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not db._schema_ready:
+            await asyncio.to_thread(db.init_db)
+        return await fn(*args, **kwargs)
+    return wrapper
+
+
+async def ping(timeout: float = 2.0):
+    """True if Mongo answers within `timeout` seconds (readiness checks)."""
+    try:
+        await asyncio.wait_for(get_database().command("ping"), timeout)
+        return True
+    except (PyMongoError, asyncio.TimeoutError):
+        return False
+
+
+# -------------------------
+# Event log
+# -------------------------
+@uses_db
+async def get_events(candidate_id: str, limit: int = 1000):
+    """Return events for a candidate (most recent first)."""
+    cursor = get_database().detections.find(**events_query(candidate_id, limit))
+    return [_serialize(doc) async for doc in cursor]
+
+
+@uses_db
+async def get_log_cursor(candidate_id: str):
+    """Cursor of the candidate's most recent settled change (None if none yet), one indexed lookup."""
+    doc = await get_database().detections.find_one(**log_cursor_query(candidate_id))
+    return make_cursor(doc) if doc else None
+
+
+@uses_db
+async def get_events_since(candidate_id: str, since: str, limit: int = 1000):
+    """
+    Events created or updated after `since` (a cursor), oldest change first,
+    up to db.LOG_SETTLE_MS ago. Returns (events, cursor of the last returned change).
+    """
+    cursor = get_database().detections.find(**events_since_query(candidate_id, since, limit))
+    events, last = [], None
+    async for doc in cursor:
+        last = make_cursor(doc)
+        events.append(_serialize(doc))
+    return events, last or since
+
+
+@uses_db
+async def get_summary(candidate_id: str):
+    """Totals by event type for a candidate, without scanning detections."""
+    return format_summary(await get_database().summaries.find_one({"_id": candidate_id}))
+
+
+# -------------------------
+# Users
+# -------------------------
+async def _create_user(collection: str, username: str, password: str, name: str, email: str):
+    if collection not in db.unique_usernames:
+        # No unique index (see db.init_db): a lookup first is all that stops a duplicate
+        if await get_database()[collection].find_one({"username": username}, {"_id": 1}):
+            return None
+    try:
+        result = await get_database()[collection].insert_one(new_user_doc(username, password, name, email))
+    except DuplicateKeyError:
+        return None  # already exists (unique username index)
+    return {"id": str(result.inserted_id), "name": name}
+
+
+async def _authenticate(collection: str, username: str, password: str):
+    user = await get_database()[collection].find_one(credentials_filter(username, password), USER_PROJECTION)
+    return user_info(user) if user else None
+
+
+@uses_db
+async def create_candidate(username: str, password: str, name: str = "", email: str = ""):
+    """Create a new candidate account (simple password storage for demo)."""
+    return await _create_user("candidates", username, password, name, email)
+
+
+@uses_db
+async def authenticate_candidate(username: str, password: str):
+    """Verify candidate login and return ID if success."""
+    return await _authenticate("candidates", username, password)
+
+
+@uses_db
+async def create_interviewer(username: str, password: str, name: str = "", email: str = ""):
+    """Create a new interviewer account."""
+    return await _create_user("interviewers", username, password, name, email)
+
+
+@uses_db
+async def authenticate_interviewer(username: str, password: str):
+    """Verify interviewer login and return ID if success."""
+    return await _authenticate("interviewers", username, password)
+
+
+# -------------------------
+# Recorded-video analysis jobs
+# -------------------------
+@uses_db
+async def get_video_job(job_id: str):
+    return await get_database().video_jobs.find_one({"_id": job_id})
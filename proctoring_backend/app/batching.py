@@ -0,0 +1,103 @@
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects single items submitted from many threads and runs them through
+    `fn` as one batch.
+
+    A batch is closed when `max_batch_size` items are waiting or when
+    `max_wait_ms` has passed since the first item of the batch arrived,
+    whichever comes first. `fn` receives a list of items and must return a
+    list of results in the same order; each caller gets its own result back
+    through a Future.
+    """
+
+    def __init__(self, fn, max_batch_size: int = 8, max_wait_ms: float = 10.0, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()   # batch size -> number of batches
+
+    def submit(self, item) -> Future:
+        if self._thread is None:
+            self._start()
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item):
+        """Submit one item and block until its result is ready."""
+        return self.submit(item).result()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = dict(self.batch_sizes)
+        batches = sum(sizes.values())
+        items = sum(size * count for size, count in sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (items / batches) if batches else 0.0,
+            "batch_size_histogram": sizes,
+        }
+
+
+def merge_batch_stats(stats_list):
+    """Combine MicroBatcher.stats() snapshots (e.g. one per worker process)."""
+    histogram = Counter()
+    for s in stats_list:
+        histogram.update({int(k): v for k, v in s.get("batch_size_histogram", {}).items()})
+    batches = sum(histogram.values())
+    items = sum(size * count for size, count in histogram.items())
+    return {
+        "batches": batches,
+        "items": items,
+        "mean_batch_size": (items / batches) if batches else 0.0,
+        "batch_size_histogram": dict(sorted(histogram.items())),
+    }
@@ -1,10 +1,29 @@
 
 import os
-from pymongo import MongoClient, ASCENDING
-from datetime import datetime
+import functools
+import threading
+from pymongo import MongoClient, ASCENDING, InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(MONGO_URI)
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", 50))                 # max connections per client
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 2000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 5000))             # per-request deadline of API queries (async_db.py)
+LOG_SETTLE_MS = int(os.getenv("LOG_SETTLE_MS", 1000))                   # age before a change is served past a /logs cursor
+SUMMARY_BATCH_HISTORY = 20                                              # batch ids a summary remembers against double counting
+
+CLIENT_OPTIONS = {
+    "maxPoolSize": MONGO_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+}
+# Used by the event writer, reports and CLIs (no per-operation deadline: report scans can be long)
+client = MongoClient(MONGO_URI, connect=False, **CLIENT_OPTIONS)  # connects on first use, not at import
 db = client["proctoring_db"]
 
 # Add schema validation for candidates and interviewers collections
@@ -17,7 +36,7 @@ candidate_schema = {
             "password": {"bsonType": "string"},
             "name": {"bsonType": "string"},
             "email": {"bsonType": "string", "pattern": "^.+@.+$"},
-            "created_at": {"bsonType": "string"}
+            "created_at": {"bsonType": ["date", "string"]}
         }
     }
 }
@@ -30,104 +49,319 @@ interviewer_schema = {
             "password": {"bsonType": "string"},
             "name": {"bsonType": "string"},
             "email": {"bsonType": "string", "pattern": "^.+@.+$"},
-            "created_at": {"bsonType": "string"}
+            "created_at": {"bsonType": ["date", "string"]}
         }
     }
 }
 
-# Ensure collection exists and create an index on candidate_id
-if "detections" not in db.list_collection_names():
-    detections_collection = db.create_collection("detections")
-    detections_collection.create_index([("candidate_id", ASCENDING), ("timestamp", ASCENDING)])
-else:
-    detections_collection = db["detections"]
-
-# Add/modify candidates collection with validation
-if "candidates" not in db.list_collection_names():
-    candidates_collection = db.create_collection("candidates", validator=candidate_schema)
-else:
-    db.command({
-        "collMod": "candidates",
-        "validator": candidate_schema
-    })
-    candidates_collection = db["candidates"]
-
-# Add/modify interviewers collection with validation
-if "interviewers" not in db.list_collection_names():
-    interviewers_collection = db.create_collection("interviewers", validator=interviewer_schema)
-else:
-    db.command({
-        "collMod": "interviewers",
-        "validator": interviewer_schema
-    })
-    interviewers_collection = db["interviewers"]
-
-def insert_event(candidate_id: str, event: dict):
+# Collection handles are lazy: nothing talks to Mongo until the first query
+detections_collection = db["detections"]
+candidates_collection = db["candidates"]
+interviewers_collection = db["interviewers"]
+# Running per-candidate totals, one document per candidate (_id = candidate_id)
+summaries_collection = db["summaries"]
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+unique_usernames = set()  # user collections whose unique username index exists
+
+def init_db():
+    """
+    Create collections, validators and indexes. Runs once per process, on the
+    first database call (or explicitly at startup); importing db.py never
+    touches the server. If Mongo is unreachable it raises and the next call
+    tries again.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        existing = set(db.list_collection_names())
+
+        if "detections" not in existing:
+            db.create_collection("detections")
+        detections_collection.create_index([("candidate_id", ASCENDING), ("timestamp", ASCENDING)])
+        # Incremental /logs reads: changes per candidate in write order
+        detections_collection.create_index([("candidate_id", ASCENDING), ("updated_at", ASCENDING), ("_id", ASCENDING)])
+        # Post-hoc video analysis replaces a chunk's events on re-run
+        detections_collection.create_index([("job_id", ASCENDING), ("chunk", ASCENDING)], sparse=True)
+
+        # Add/modify candidates and interviewers collections with validation
+        for name, schema in (("candidates", candidate_schema), ("interviewers", interviewer_schema)):
+            if name not in existing:
+                db.create_collection(name, validator=schema)
+            else:
+                db.command({"collMod": name, "validator": schema})
+
+        # Logins and registrations look users up by username
+        for _coll in (candidates_collection, interviewers_collection):
+            try:
+                _coll.create_index([("username", ASCENDING)], unique=True)
+                unique_usernames.add(_coll.name)
+            except OperationFailure as e:  # existing duplicate usernames must be cleaned up first
+                print(f"[db] could not create unique username index on {_coll.name}, "
+                      f"registrations fall back to a lookup first: {e}")
+        _schema_ready = True
+
+def uses_db(fn):
+    """Decorator: make sure init_db() has run before fn touches a collection."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        init_db()
+        return fn(*args, **kwargs)
+    return wrapper
+
+def make_event_doc(candidate_id: str, event: dict):
     """
     event should be a dict with keys like:
-      { "type": "OBJECT_DETECTED", "details": "...", "timestamp": "ISO...", "frame_id": 12, ... }
+      { "type": "OBJECT_DETECTED", "details": "...", "timestamp": datetime, "frame_id": 12, ... }
+    timestamp defaults to now and is always stored as a BSON datetime (ISO strings are parsed).
+    The _id is assigned here so that a retried write cannot insert the event twice;
+    episode records (see episodes.py) reuse their episode_id so all of an
+    episode's updates land on one document.
     """
     doc = {
+        "_id": ObjectId(event["episode_id"]) if "episode_id" in event else ObjectId(),
         "candidate_id": candidate_id,
-        "timestamp": event.get("timestamp", datetime.utcnow().isoformat()),
         **event
     }
-    detections_collection.insert_one(doc)
+    timestamp = event.get("timestamp") or datetime.utcnow()
+    doc["timestamp"] = datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
+    return doc
+
+@uses_db
+def write_events(docs: list):
+    """
+    Bulk write of documents built with make_event_doc (episodes are upserted).
+    Every document gets `updated_at` = time of this write, which is what the
+    /logs cursor follows.
+    """
+    updated_at = _now_ms()
+    ops = []
+    for doc in docs:
+        doc["updated_at"] = updated_at
+        if "episode_id" in doc:
+            fields = {k: v for k, v in doc.items() if k != "_id"}
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}, upsert=True))
+        else:
+            ops.append(InsertOne(doc))
+    if ops:
+        detections_collection.bulk_write(ops, ordered=False)
+
+def summary_increments(docs: list):
+    """
+    Per-candidate count increments for a batch of event documents. Only new
+    events count: plain events and the "open" record of an episode. Call this
+    before coalescing, so an episode opened and closed in one batch still counts.
+    """
+    increments = {}
+    for doc in docs:
+        if doc.get("status", "open") != "open":
+            continue
+        inc = increments.setdefault(doc["candidate_id"], {"counts": {}, "first": doc["timestamp"], "last": doc["timestamp"]})
+        inc["counts"][doc["type"]] = inc["counts"].get(doc["type"], 0) + 1
+        inc["first"] = min(inc["first"], doc["timestamp"])
+        inc["last"] = max(inc["last"], doc["timestamp"])
+    return increments
+
+@uses_db
+def update_summaries(increments: dict, batch_id: str = None):
+    """
+    Apply summary_increments() with atomic $inc/$min/$max upserts, one per candidate.
+    With a `batch_id`, each summary remembers the last SUMMARY_BATCH_HISTORY
+    batches applied to it and skips a batch it has already counted, so a
+    retry after an ambiguous failure does not count it twice (the skipped
+    upsert fails with a duplicate key error, which callers treat as done).
+    """
+    ops = []
+    for candidate_id, inc in increments.items():
+        counts = {f"counts.{event_type}": n for event_type, n in inc["counts"].items()}
+        update = {"$inc": {**counts, "total": sum(inc["counts"].values())}}
+        if inc.get("first"):  # a correction that only removes events moves neither bound
+            update["$min"] = {"first_event_at": inc["first"]}
+            update["$max"] = {"last_event_at": inc["last"]}
+        query = {"_id": candidate_id}
+        if batch_id:
+            query["applied_batches"] = {"$ne": batch_id}
+            update["$push"] = {"applied_batches": {"$each": [batch_id], "$slice": -SUMMARY_BATCH_HISTORY}}
+        ops.append(UpdateOne(query, update, upsert=True))
+    if ops:
+        summaries_collection.bulk_write(ops, ordered=False)
+
+def _now_ms():
+    """UTC now truncated to milliseconds (BSON datetime precision), so cursors round-trip exactly."""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+# Fields the dashboard and reports read from a detections document (plus _id)
+LOG_PROJECTION = {field: 1 for field in ("type", "details", "status", "timestamp", "end", "duration", "frames",
+                                         "peak_confidence", "episode_id", "updated_at", "source", "video_time")}
+USER_PROJECTION = {"_id": 1, "name": 1}
+
+def _serialize(doc: dict):
+    """Make a detections document JSON-safe: _id -> id, datetimes -> ISO strings."""
+    doc["id"] = str(doc.pop("_id"))
+    for k, v in doc.items():
+        if isinstance(v, datetime):
+            doc[k] = v.isoformat()
+    return doc
+
+def make_cursor(doc: dict):
+    """Opaque /logs cursor: '<updated_at epoch ms>-<_id>' of the last change seen."""
+    updated_at = doc.get("updated_at")
+    ms = int(updated_at.replace(tzinfo=timezone.utc).timestamp() * 1000) if updated_at else 0
+    return f"{ms}-{doc['_id']}"
 
-def get_events(candidate_id: str, limit: int = 1000):
-    """Return events for a candidate (most recent first)."""
+ZERO_CURSOR = "0-" + "0" * 24   # before any event
+
+def parse_cursor(cursor: str):
+    ms, oid = cursor.split("-", 1)
+    return datetime.fromtimestamp(int(ms) / 1000, tz=timezone.utc).replace(tzinfo=None), ObjectId(oid)
+
+# -------------------------
+# API queries: the filters, sorts and projections live here, async_db.py runs them
+# -------------------------
+def events_query(candidate_id: str, limit: int):
+    """find() arguments for a candidate's `limit` most recent events."""
+    return {"filter": {"candidate_id": candidate_id}, "projection": LOG_PROJECTION,
+            "sort": [("timestamp", -1)], "limit": limit}
+
+# `updated_at` is stamped by each writer before its write lands, and a bulk
+# write's inserts and episode updates commit separately, so a change can
+# become visible after a later-stamped one was already read. Cursors only
+# advance over changes older than LOG_SETTLE_MS; newer ones are served on
+# a later read.
+def settled_before():
+    return _now_ms() - timedelta(milliseconds=LOG_SETTLE_MS)
+
+def log_cursor_query(candidate_id: str):
+    """find_one() arguments for the candidate's most recent settled change (one indexed lookup)."""
+    return {"filter": {"candidate_id": candidate_id, "updated_at": {"$lt": settled_before()}},
+            "projection": {"_id": 1, "updated_at": 1}, "sort": [("updated_at", -1), ("_id", -1)]}
+
+def events_since_query(candidate_id: str, since: str, limit: int):
+    """find() arguments for the settled changes after cursor `since`, oldest change first."""
+    updated_at, oid = parse_cursor(since)
+    return {
+        "filter": {
+            "candidate_id": candidate_id,
+            "updated_at": {"$lt": settled_before()},
+            "$or": [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$gt": oid}},
+            ],
+        },
+        "projection": LOG_PROJECTION,
+        "sort": [("updated_at", 1), ("_id", 1)],
+        "limit": limit,
+    }
+
+def format_summary(doc: dict):
+    """A summaries document (or None) as returned by /summary."""
+    doc = doc or {"counts": {}, "total": 0}
+    doc.pop("_id", None)
+    doc.pop("applied_batches", None)
+    for k, v in doc.items():
+        if isinstance(v, datetime):
+            doc[k] = v.isoformat()
+    return doc
+
+def credentials_filter(username: str, password: str):
+    return {"username": username, "password": password}
+
+def user_info(doc: dict):
+    return {"id": str(doc["_id"]), "name": doc["name"]}
+
+@uses_db
+def iter_events(candidate_id: str, batch_size: int = 1000):
+    """Yield a candidate's events oldest first, fetched from Mongo `batch_size` at a time (reports)."""
     cursor = detections_collection.find(
         {"candidate_id": candidate_id},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(limit)
-    return list(cursor)
+        {"_id": 0, "candidate_id": 0}
+    ).sort("timestamp", 1).batch_size(batch_size)
+    for doc in cursor:
+        yield doc
 
+@uses_db
+def summary_counts(candidate_id: str):
+    """(counts by type, total) from the candidate's summary, without scanning detections (reports)."""
+    doc = summaries_collection.find_one({"_id": candidate_id}, {"counts": 1, "total": 1}) or {}
+    counts = {event_type: n for event_type, n in doc.get("counts", {}).items() if n}  # 0 once corrected away
+    return counts, doc.get("total", 0)
 
-candidates_collection = db["candidates"]
-interviewers_collection = db["interviewers"]
-
-def create_candidate(username: str, password: str, name: str = "", email: str = ""):
-    """Create a new candidate account (simple password storage for demo)."""
-    existing = candidates_collection.find_one({"username": username})
-    if existing:
-        return None  # already exists
 
-    candidate = {
+def new_user_doc(username: str, password: str, name: str = "", email: str = ""):
+    return {
         "username": username,
         "password": password,   # ⚠️ for production: hash this!
         "name": name,
         "email": email,
-        "created_at": datetime.utcnow().isoformat(),
+        "created_at": datetime.utcnow(),
     }
-    result = candidates_collection.insert_one(candidate)
-    return {"id": str(result.inserted_id), "name": name}
-
-def authenticate_candidate(username: str, password: str):
-    """Verify candidate login and return ID if success."""
-    candidate = candidates_collection.find_one({"username": username, "password": password})
-    if candidate:
-        return {"id": str(candidate["_id"]), "name": candidate["name"]}
-    return None
-
-def create_interviewer(username: str, password: str, name: str = "", email: str = ""):
-    """Create a new interviewer account."""
-    existing = interviewers_collection.find_one({"username": username})
-    if existing:
-        return None
-    interviewer = {
-        "username": username,
-        "password": password,
-        "name": name,
-        "email": email,
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    result = interviewers_collection.insert_one(interviewer)
-    return {"id": str(result.inserted_id), "name": name}
 
-def authenticate_interviewer(username: str, password: str):
-    """Verify interviewer login and return ID if success."""
-    interviewer = interviewers_collection.find_one({"username": username, "password": password})
-    if interviewer:
-        return {"id": str(interviewer["_id"]), "name": interviewer["name"]}
-    return None
 
+# -------------------------
+# Recorded-video analysis jobs (video_analysis.py)
+# -------------------------
+video_jobs_collection = db["video_jobs"]
+
+@uses_db
+def create_video_job(job: dict):
+    """Insert a job unless one with the same _id exists; returns the stored job."""
+    video_jobs_collection.update_one({"_id": job["_id"]}, {"$setOnInsert": job}, upsert=True)
+    return video_jobs_collection.find_one({"_id": job["_id"]})
+
+@uses_db
+def update_video_job(job_id: str, fields: dict):
+    video_jobs_collection.update_one({"_id": job_id}, {"$set": {**fields, "updated_at": datetime.utcnow()}})
+
+@uses_db
+def replace_chunk_events(job_id: str, chunk: int, docs: list):
+    """
+    Idempotently store the events of one analyzed chunk (a re-run replaces the
+    previous attempt). The summaries are corrected by the difference: the new
+    chunk's events are counted and the replaced attempt's are taken off.
+    Every stored document is one event here (episodes are already coalesced).
+    """
+    old = detections_collection.aggregate([
+        {"$match": {"job_id": job_id, "chunk": chunk}},
+        {"$group": {"_id": {"candidate_id": "$candidate_id", "type": "$type"}, "n": {"$sum": 1}}},
+    ])
+    increments = {}
+    for row in old:
+        counts = increments.setdefault(row["_id"]["candidate_id"], {"counts": {}})["counts"]
+        counts[row["_id"]["type"]] = counts.get(row["_id"]["type"], 0) - row["n"]
+    for doc in docs:
+        inc = increments.setdefault(doc["candidate_id"], {"counts": {}})
+        inc["counts"][doc["type"]] = inc["counts"].get(doc["type"], 0) + 1
+        inc["first"] = min(inc.get("first") or doc["timestamp"], doc["timestamp"])
+        inc["last"] = max(inc.get("last") or doc["timestamp"], doc["timestamp"])
+
+    detections_collection.delete_many({"job_id": job_id, "chunk": chunk})
+    write_events(docs)
+    for inc in increments.values():
+        inc["counts"] = {event_type: n for event_type, n in inc["counts"].items() if n}
+    update_summaries({cid: inc for cid, inc in increments.items() if inc["counts"]})
+
+@uses_db
+def migrate_string_timestamps(batch_size: int = 1000):
+    """One-off: convert detections stored with ISO-string timestamps to BSON datetimes."""
+    converted = 0
+    ops = []
+    for doc in detections_collection.find({"timestamp": {"$type": "string"}}, {"timestamp": 1}):
+        try:
+            ts = datetime.fromisoformat(doc["timestamp"])
+        except ValueError:
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"timestamp": ts}}))
+        if len(ops) >= batch_size:
+            converted += detections_collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        converted += detections_collection.bulk_write(ops, ordered=False).modified_count
+    return converted
+
+if __name__ == "__main__":
+    print(f"Converted {migrate_string_timestamps()} string timestamps")
@@ -1,10 +1,14 @@
 # detect_and_store.py
 import time
 import argparse
+import threading
+from collections import deque
 from ultralytics import YOLO
 import cv2
 import mediapipe as mp
-from db import insert_event
+from event_writer import event_writer
+from face_tracker import FaceTracker, KEYFRAME_INTERVAL
+from episodes import EpisodeTracker, EPISODE_CLOSE_AFTER
 from datetime import datetime
 
 # -------------------------
@@ -13,28 +17,13 @@ from datetime import datetime
 NO_FACE_SECONDS = 10        # if no face for this many seconds -> NO_FACE event
 FOCUS_AWAY_SECONDS = 5      # if looking away for this many seconds -> FOCUS_LOST
 FACE_CENTER_THRESHOLD = 0.15  # fraction of frame width (15%) considered centered
-OBJECT_COOLDOWN = 5         # seconds cooldown between logs for same object label
+EPISODE_GAP = EPISODE_CLOSE_AFTER  # seconds a condition may be unseen before its episode closes (same as the API)
+FRAME_QUEUE_SIZE = 1        # frames buffered between capture and inference (pipeline mode; newest wins)
 
 # Suspicious keywords in YOLO label
 SUSPICIOUS_KEYWORDS = ["phone", "cell", "book", "notebook", "paper", "laptop", "tablet"]
 
-# -------------------------
-# Init models
-# -------------------------
-print("Loading YOLO model...")
-yolo = YOLO("yolov8n.pt")   # small & fast - change to yolov8s/m if you want more accuracy
-
-print("Initializing MediaPipe face detector...")
-mp_face = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.5)
-
-# -------------------------
-# State variables
-# -------------------------
-last_face_seen = time.time()
-focus_away_start = None
-last_no_face_logged = 0
-last_multiple_faces_logged = 0
-last_object_logged_time = {}  # dict[label] = last_logged_timestamp
+WINDOW_TITLE = "Proctoring - Webcam {cam_index} (press q to quit)"
 
 # -------------------------
 # Helpers
@@ -49,50 +38,82 @@ def is_suspicious_label(label: str):
             return True
     return False
 
-def log_event(candidate_id, event_type, details, extra=None):
+def log_episodes(candidate_id, records):
+    """Queue episode records from the EpisodeTracker; prints when an episode opens or closes."""
+    for rec in records:
+        event_writer.submit(candidate_id, rec)
+        if rec["status"] != "ongoing":
+            print(f"[{now_iso()}] {candidate_id} {rec['type']} {rec['status']} - {rec['details']} ({rec['duration']:.1f}s)")
+
+def load_models():
     """
-    Inserts event into MongoDB via db.insert_event
-    `extra` can hold bounding box, confidence, frame_id, etc.
+    A YOLO model and a MediaPipe face detector. Neither is safe to call from
+    several threads at once, so every source loads its own pair.
     """
-    event = {
-        "type": event_type,
-        "details": details,
-        "timestamp": now_iso()
-    }
-    if extra:
-        event.update(extra)
-    insert_event(candidate_id, event)
-    print(f"[{event['timestamp']}] {event_type} - {details}")
+    print("Loading YOLO model...")
+    yolo = YOLO("yolov8n.pt")   # small & fast - change to yolov8s/m if you want more accuracy
 
-# -------------------------
-# Main webcam loop
-# -------------------------
-def process_webcam(candidate_id: str, cam_index=0):
-    global last_face_seen, focus_away_start, last_no_face_logged, last_multiple_faces_logged
+    print("Initializing MediaPipe face detector...")
+    mp_face = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.5)
+    return yolo, mp_face
 
+def open_camera(cam_index: int):
     cap = cv2.VideoCapture(cam_index)
     if not cap.isOpened():
-        raise RuntimeError("Unable to open webcam. Check cam_index or permissions.")
+        raise RuntimeError(f"Unable to open webcam {cam_index}. Check cam_index or permissions.")
+    return cap
 
-    frame_id = 0
-    print("Starting webcam. Press 'q' to quit.")
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Frame read failed, exiting.")
-            break
+def render(frame, frame_id, face_count, face_center_x_norm, yolo_result=None):
+    """Draw YOLO boxes and the status line; only needed when frames are displayed."""
+    # plot() draws on a copy, so the overlay can be written on it directly
+    annotated = yolo_result.plot() if yolo_result is not None else frame
+    status_text = f"Frame: {frame_id}  Faces: {face_count}"
+    if face_center_x_norm is not None:
+        offset_pct = (face_center_x_norm - 0.5) * 200  # percent left or right
+        status_text += f"  FaceOffset: {offset_pct:.1f}%"
+    cv2.putText(annotated, status_text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
+    return annotated
+
+# -------------------------
+# Per-source detection state
+# -------------------------
+class SourceState:
+    """
+    Models, timers and open episodes of one camera. With `track=True`
+    MediaPipe only runs on keyframes and the face is followed with optical
+    flow in between (see FaceTracker).
+    """
 
-        frame_h, frame_w = frame.shape[:2]
-        timestamp = time.time()
+    def __init__(self, candidate_id: str, track=False, keyframe_interval=KEYFRAME_INTERVAL):
+        self.candidate_id = candidate_id
+        self.yolo, self.mp_face = load_models()
+        self.tracker = FaceTracker(self.mp_face, keyframe_interval=keyframe_interval) if track else None
+        self.episodes = EpisodeTracker(close_after=EPISODE_GAP)  # one row per episode instead of per-frame cooldowns
+        self.last_face_seen = time.time()
+        self.focus_away_start = None
 
-        # ---- MediaPipe face detection (for presence/multiple/focus) ----
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_results = mp_face.process(rgb)
+    def log(self, records):
+        log_episodes(self.candidate_id, records)
 
+    def analyze(self, frame, frame_id, timestamp):
+        """
+        Run face and object detection on one frame and log the resulting
+        episodes. Returns (face_count, face_center_x_norm, YOLO result or None).
+        """
+        # ---- MediaPipe face detection (for presence/multiple/focus) ----
         face_count = 0
         face_center_x_norm = None
 
-        if face_results.detections:
+        if self.tracker is not None:
+            face_count, face_center_x_norm, _ = self.tracker.update(frame)
+            if face_count:
+                self.last_face_seen = timestamp
+            face_results = None
+        else:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_results = self.mp_face.process(rgb)
+
+        if face_results is not None and face_results.detections:
             face_count = len(face_results.detections)
 
             # Use first face bbox to estimate center (we assume candidate is primary face)
@@ -100,24 +121,19 @@ def process_webcam(candidate_id: str, cam_index=0):
             bb = face_results.detections[0].location_data.relative_bounding_box
             cx = bb.xmin + bb.width / 2.0  # relative 0..1
             face_center_x_norm = cx  # normalized center x
-            last_face_seen = timestamp
-        else:
-            # no face detected in this frame
-            pass
+            self.last_face_seen = timestamp
 
         # ---- NO FACE logic (> NO_FACE_SECONDS) ----
-        if (time.time() - last_face_seen) > NO_FACE_SECONDS:
-            # avoid logging repeatedly: allow log once per NO_FACE_SECONDS
-            if time.time() - last_no_face_logged > NO_FACE_SECONDS:
-                log_event(candidate_id, "NO_FACE", f"No face detected for >{NO_FACE_SECONDS} seconds", extra={"frame_id": frame_id})
-                last_no_face_logged = time.time()
+        # Each condition below is an episode: logged once when it starts,
+        # updated while it lasts, closed after EPISODE_GAP seconds unseen.
+        if (timestamp - self.last_face_seen) > NO_FACE_SECONDS:
+            self.log(self.episodes.observe(
+                "NO_FACE", f"No face detected for >{NO_FACE_SECONDS} seconds", timestamp, extra={"frame_id": frame_id}))
 
         # ---- MULTIPLE FACES logic ----
         if face_count > 1:
-            # cooldown to avoid spamming
-            if time.time() - last_multiple_faces_logged > 10:
-                log_event(candidate_id, "MULTIPLE_FACES", f"{face_count} faces detected in frame", extra={"frame_id": frame_id})
-                last_multiple_faces_logged = time.time()
+            self.log(self.episodes.observe(
+                "MULTIPLE_FACES", f"{face_count} faces detected in frame", timestamp, extra={"frame_id": frame_id}))
 
         # ---- FOCUS / LOOKING AWAY logic ----
         # If we have a face center, compare its normalized x with 0.5 (center)
@@ -125,76 +141,257 @@ def process_webcam(candidate_id: str, cam_index=0):
             offset = face_center_x_norm - 0.5  # negative => left, positive => right
             if abs(offset) <= FACE_CENTER_THRESHOLD:
                 # considered looking forward
-                focus_away_start = None
-            else:
+                self.focus_away_start = None
+            elif self.focus_away_start is None:
                 # looking away (left/right)
-                if focus_away_start is None:
-                    focus_away_start = time.time()
-                else:
-                    # if sustained longer than threshold -> log
-                    if time.time() - focus_away_start > FOCUS_AWAY_SECONDS:
-                        direction = "left" if offset < 0 else "right"
-                        log_event(candidate_id, "FOCUS_LOST", f"Looking {direction} for >{FOCUS_AWAY_SECONDS}s", extra={"frame_id": frame_id})
-                        focus_away_start = None  # reset after logging
+                self.focus_away_start = timestamp
+            elif timestamp - self.focus_away_start > FOCUS_AWAY_SECONDS:
+                # sustained longer than threshold -> log
+                direction = "left" if offset < 0 else "right"
+                self.log(self.episodes.observe(
+                    "FOCUS_LOST", f"Looking {direction} for >{FOCUS_AWAY_SECONDS}s", timestamp,
+                    key=f"FOCUS_LOST:{direction}", extra={"frame_id": frame_id}))
 
         # ---- YOLO object detection ----
-        # Run inference (this returns results with boxes)
-        yolo_results = yolo(frame, verbose=False)
-
-        # annotate_frame from YOLO (use first result)
-        annotated = frame
-        if len(yolo_results) > 0:
-            annotated = yolo_results[0].plot()  # draws boxes/labels on the frame
-
-            # iterate boxes and conditionally log suspicious objects
-            for box in yolo_results[0].boxes:
-                cls_id = int(box.cls[0])
-                label = yolo.names[cls_id]
-                conf = float(box.conf[0]) if hasattr(box.conf, "__len__") else float(box.conf)
-                label_lower = label.lower()
-
-                if is_suspicious_label(label):
-                    # use a cooldown so we don't insert duplicate events every frame
-                    now_t = time.time()
-                    last_t = last_object_logged_time.get(label_lower, 0)
-                    if now_t - last_t > OBJECT_COOLDOWN:
-                        details = f"{label} detected (conf={conf:.2f})"
-                        bbox = None
-                        try:
-                            xyxy = list(map(float, box.xyxy[0]))
-                            bbox = { "x_min": xyxy[0], "y_min": xyxy[1], "x_max": xyxy[2], "y_max": xyxy[3] }
-                        except Exception:
-                            bbox = None
-                        extra = {"frame_id": frame_id, "confidence": conf, "bbox": bbox}
-                        log_event(candidate_id, "OBJECT_DETECTED", details, extra=extra)
-                        last_object_logged_time[label_lower] = now_t
-
-        # ---- Display info on screen (simple overlay) ----
-        overlay = annotated.copy()
-        status_text = f"Frame: {frame_id}  Faces: {face_count}"
-        if face_center_x_norm is not None:
-            offset_pct = (face_center_x_norm - 0.5) * 200  # percent left or right
-            status_text += f"  FaceOffset: {offset_pct:.1f}%"
-        cv2.putText(overlay, status_text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
+        yolo_results = self.yolo(frame, verbose=False)
+        result = yolo_results[0] if len(yolo_results) > 0 else None
+
+        # iterate boxes and conditionally log suspicious objects
+        for box in (result.boxes if result is not None else ()):
+            label = self.yolo.names[int(box.cls[0])]
+            if not is_suspicious_label(label):
+                continue
+            conf = float(box.conf[0]) if hasattr(box.conf, "__len__") else float(box.conf)
+            # one episode per label while it stays in view
+            try:
+                xyxy = list(map(float, box.xyxy[0]))
+                bbox = { "x_min": xyxy[0], "y_min": xyxy[1], "x_max": xyxy[2], "y_max": xyxy[3] }
+            except Exception:
+                bbox = None
+            self.log(self.episodes.observe(
+                "OBJECT_DETECTED", f"{label} detected", timestamp, key=f"OBJECT_DETECTED:{label.lower()}",
+                confidence=conf, extra={"frame_id": frame_id, "bbox": bbox}))
+
+        self.log(self.episodes.sweep(timestamp))
+        return face_count, face_center_x_norm, result
+
+    def close(self):
+        self.log(self.episodes.close_all())
+
+# -------------------------
+# Sequential webcam loop
+# -------------------------
+def process_webcam(candidate_id: str, cam_index=0, track=False, keyframe_interval=KEYFRAME_INTERVAL,
+                   headless=False):
+    """
+    Capture, detect and display one frame at a time on the calling thread.
+    `headless` skips drawing and the window entirely.
+    """
+    source = SourceState(candidate_id, track, keyframe_interval)
+    cap = open_camera(cam_index)
+
+    frame_id = 0
+    print("Starting webcam. Press Ctrl+C to quit." if headless else "Starting webcam. Press 'q' to quit.")
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                print("Frame read failed, exiting.")
+                break
+
+            face_count, face_center_x_norm, result = source.analyze(frame, frame_id, time.time())
+            if not headless:
+                cv2.imshow(WINDOW_TITLE.format(cam_index=cam_index),
+                           render(frame, frame_id, face_count, face_center_x_norm, result))
+            frame_id += 1
+
+            # quit key
+            if not headless and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        if not headless:
+            cv2.destroyAllWindows()
+        source.close()
+        event_writer.close()
+
+# -------------------------
+# Pipelined mode
+# -------------------------
+class LatestFrames:
+    """
+    Bounded hand-off between two pipeline stages. When it is full, `put()`
+    drops the oldest item instead of blocking, so the producer never stalls
+    and a slow consumer always works on the newest frames.
+    """
+
+    def __init__(self, size: int = FRAME_QUEUE_SIZE):
+        self._items = deque(maxlen=max(1, size))
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: float = None):
+        """Oldest buffered item; None after `timeout`, or once closed and drained."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self.closed, timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
 
-        cv2.imshow("Proctoring - Webcam (press q to quit)", overlay)
 
-        frame_id += 1
+class SourcePipeline:
+    """
+    One camera split into stages: a capture thread reads frames as fast as
+    the camera delivers them, an inference thread analyzes the newest one
+    and logs episodes (event_writer does the Mongo writes on its own
+    thread), and the caller's thread draws and shows the results. Frames
+    that arrive while inference is busy are dropped rather than queued.
+    """
+
+    def __init__(self, candidate_id: str, cam_index: int, stop: threading.Event, headless=False, track=False,
+                 keyframe_interval=KEYFRAME_INTERVAL, queue_size=FRAME_QUEUE_SIZE):
+        self.cam_index = cam_index
+        self.stop = stop  # shared by every source
+        self.source = SourceState(candidate_id, track, keyframe_interval)
+        self.cap = open_camera(cam_index)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # don't let the driver hold stale frames either (not every backend honours it)
+        self.frames = LatestFrames(queue_size)
+        self.display = None if headless else LatestFrames(1)
+        self.window = WINDOW_TITLE.format(cam_index=cam_index)
+
+        self.captured = 0
+        self.analyzed = 0
+        self.started = None
+        self._threads = [
+            threading.Thread(target=self._capture, name=f"capture-{cam_index}", daemon=True),
+            threading.Thread(target=self._infer, name=f"inference-{cam_index}", daemon=True),
+        ]
+
+    def start(self):
+        self.started = time.time()
+        for t in self._threads:
+            t.start()
+
+    @property
+    def running(self):
+        return self._threads[1].is_alive()
+
+    def join(self, timeout: float = 10.0):
+        for t in self._threads:
+            t.join(timeout)
 
-        # quit key
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    def _capture(self):
+        try:
+            while not (self.stop.is_set() or self.frames.closed):
+                ret, frame = self.cap.read()
+                if not ret:
+                    print(f"[cam {self.cam_index}] Frame read failed, stopping.")
+                    break
+                self.frames.put((self.captured, time.time(), frame))
+                self.captured += 1
+        finally:
+            self.cap.release()
+            self.frames.close()
 
-    cap.release()
-    cv2.destroyAllWindows()
+    def _infer(self):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                frame_id, timestamp, frame = item
+                face_count, face_center_x_norm, result = self.source.analyze(frame, frame_id, timestamp)
+                self.analyzed += 1
+                if self.display is not None:
+                    self.display.put((frame, frame_id, face_count, face_center_x_norm, result))
+        finally:
+            self.frames.close()  # stops capture if inference failed
+            self.source.close()
+
+    def stats(self):
+        elapsed = max(time.time() - (self.started or time.time()), 1e-6)
+        return (f"[cam {self.cam_index}] {self.source.candidate_id}: captured {self.captured}, "
+                f"analyzed {self.analyzed} ({self.analyzed / elapsed:.1f} fps), dropped {self.frames.dropped}")
+
+
+def run_pipeline(candidate_ids, cam_indexes, headless=False, track=False, keyframe_interval=KEYFRAME_INTERVAL,
+                 queue_size=FRAME_QUEUE_SIZE):
+    """
+    Run one SourcePipeline per camera in this process. Windows are drawn
+    from the calling (main) thread, as GUI backends require; `headless`
+    skips drawing and copying results altogether.
+    """
+    stop = threading.Event()
+    pipelines = [SourcePipeline(candidate_id, cam_index, stop, headless, track, keyframe_interval, queue_size)
+                 for candidate_id, cam_index in zip(candidate_ids, cam_indexes)]
+    for p in pipelines:
+        p.start()
+
+    print(f"Started {len(pipelines)} source(s). " + ("Press Ctrl+C to quit." if headless else "Press 'q' to quit."))
+    try:
+        while any(p.running for p in pipelines):
+            if headless:
+                stop.wait(0.5)
+                continue
+            for p in pipelines:
+                item = p.display.get(timeout=0)
+                if item is not None:
+                    cv2.imshow(p.window, render(*item))
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for p in pipelines:
+            p.join()
+            print(p.stats())
+        if not headless:
+            cv2.destroyAllWindows()
+        event_writer.close()
 
 # -------------------------
 # CLI
 # -------------------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run webcam YOLO+MediaPipe proctoring")
-    parser.add_argument("--candidate-id", type=str, default="candidate_1", help="Candidate/session id to tag events")
-    parser.add_argument("--cam-index", type=int, default=0, help="Webcam index (default 0)")
+    parser.add_argument("--candidate-id", type=str, nargs="+", default=["candidate_1"],
+                        help="Candidate/session id to tag events; one per --cam-index, or one used as a prefix")
+    parser.add_argument("--cam-index", type=int, nargs="+", default=[0],
+                        help="Webcam index (default 0); several indexes run one pipeline each")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Capture, inference and display on separate threads, dropping stale frames "
+                             "(implied by several --cam-index)")
+    parser.add_argument("--headless", action="store_true", help="No window: skip drawing boxes and overlays")
+    parser.add_argument("--queue-size", type=int, default=FRAME_QUEUE_SIZE,
+                        help=f"Frames buffered ahead of inference in pipeline mode (default {FRAME_QUEUE_SIZE})")
+    parser.add_argument("--track", action="store_true", help="Detect faces on keyframes only and track in between")
+    parser.add_argument("--keyframe-interval", type=int, default=KEYFRAME_INTERVAL,
+                        help=f"Max frames between full face detections when tracking (default {KEYFRAME_INTERVAL})")
     args = parser.parse_args()
 
-    process_webcam(candidate_id=args.candidate_id, cam_index=args.cam_index)
+    candidate_ids = args.candidate_id
+    if len(candidate_ids) != len(args.cam_index):
+        if len(candidate_ids) != 1:
+            parser.error("give one --candidate-id, or one per --cam-index")
+        candidate_ids = [f"{candidate_ids[0]}_cam{i}" for i in args.cam_index]
+
+    if args.pipeline or len(args.cam_index) > 1:
+        run_pipeline(candidate_ids, args.cam_index, headless=args.headless, track=args.track,
+                     keyframe_interval=args.keyframe_interval, queue_size=args.queue_size)
+    else:
+        process_webcam(candidate_id=candidate_ids[0], cam_index=args.cam_index[0], track=args.track,
+                       keyframe_interval=args.keyframe_interval, headless=args.headless)
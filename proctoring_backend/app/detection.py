@@ -1,77 +1,332 @@
+import os
 import cv2
-import mediapipe as mp
-from ultralytics import YOLO
+import numpy as np
 import time
 import math
+import threading
+from collections import Counter
+from batching import MicroBatcher
+from session_state import SessionStore
+from metrics import stage_timer
 
-# Load models
-mp_face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.6)
-mp_face_mesh = mp.solutions.face_mesh.FaceMesh(refine_landmarks=True)
-yolo = YOLO("yolov8n.pt")  # small & fast
+# Micro-batching of YOLO across concurrent frames (1 = disabled)
+YOLO_MAX_BATCH = int(os.getenv("YOLO_MAX_BATCH", 1))
+YOLO_BATCH_WAIT_MS = float(os.getenv("YOLO_BATCH_WAIT_MS", 10))
 
-# State
-last_face_detected = time.time()
-focus_away_start = None
+# Detection cascade: skip heavy stages while the scene is static
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", 0.02))          # mean abs diff (0..1) that counts as motion
+YOLO_MOTION_THRESHOLD = float(os.getenv("YOLO_MOTION_THRESHOLD", 0.05))  # motion that triggers an early YOLO run
+FACE_REFRESH_FRAMES = int(os.getenv("FACE_REFRESH_FRAMES", 5))        # run face stages at least every N frames
+YOLO_EVERY_N = int(os.getenv("YOLO_EVERY_N", 5))                      # run YOLO at least every N frames
+MOTION_THUMB_SIZE = (32, 24)
 
-def get_head_orientation(landmarks, frame_w, frame_h):
-    """ Rough head orientation check: returns left, right, or forward """
-    # Nose tip landmark
-    nose = landmarks[1]
-    nose_x = nose.x * frame_w
+# Shared preprocessing: every stage reads its input from one per-frame resize pyramid (FramePrep)
+FACE_INPUT_SIZE = int(os.getenv("FACE_INPUT_SIZE", 320))           # long side fed to face detection (0 = full frame; the model runs at 128x128)
+HEAD_POSE_SOURCE = os.getenv("HEAD_POSE_SOURCE", "keypoints")      # "keypoints" (nose tip from face detection) or "mesh" (FaceMesh on the face crop)
+FACE_ROI_MARGIN = float(os.getenv("FACE_ROI_MARGIN", 0.25))        # padding around the face box cropped for FaceMesh, as a fraction of its size
+NOSE_TIP = 2  # index in MediaPipe face detection's relative_keypoints
 
-    center_x = frame_w // 2
-    offset = nose_x - center_x
+# Models are loaded on first use (load_models), so importing this module is cheap
+mp_face_detection = None
+mp_face_mesh = None  # only loaded with HEAD_POSE_SOURCE=mesh
+detector = None      # YOLOv8n; backend, input size and classes from DETECTOR_* env
+yolo_batcher = None
+models_lock = threading.Lock()
 
-    if abs(offset) < frame_w * 0.15:  # within 15% of center
+# MediaPipe graphs are not thread-safe; YOLO goes through the batcher instead
+face_lock = threading.Lock()
+
+# Per-candidate state (NO_FACE / FOCUS_LOST timers)
+sessions = SessionStore()
+
+# Cascade counters: frames, <stage>_run, <stage>_skip
+stage_counts = Counter()
+stage_lock = threading.Lock()
+
+# Preprocessing buffers, reused frame after frame by each inference thread
+_local = threading.local()
+
+def load_models():
+    """ Load MediaPipe and the object detector once per process (safe to call from any thread) """
+    global mp_face_detection, mp_face_mesh, detector, yolo_batcher
+    if detector is not None:
+        return
+    with models_lock:
+        if detector is not None:
+            return
+        t0 = time.time()
+        import mediapipe as mp
+        from object_detector import ObjectDetector
+
+        mp_face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.6)
+        if HEAD_POSE_SOURCE == "mesh":
+            mp_face_mesh = mp.solutions.face_mesh.FaceMesh(max_num_faces=1)  # only the nose tip is read: no iris refinement
+        loaded = ObjectDetector()
+        if YOLO_MAX_BATCH > 1:
+            yolo_batcher = MicroBatcher(loaded, YOLO_MAX_BATCH, YOLO_BATCH_WAIT_MS, name="yolo-batcher")
+        detector = loaded  # set last: other threads treat it as "models ready"
+        print(f"[detection] models loaded in {time.time() - t0:.1f}s")
+
+def warmup(width: int = 640, height: int = 480):
+    """ Load the models and push one blank frame through every stage, so the first real frame is not slow """
+    load_models()
+    t0 = time.time()
+    prep = FramePrep(np.zeros((height, width, 3), dtype=np.uint8))
+    with face_lock:
+        mp_face_detection.process(prep.rgb(FACE_INPUT_SIZE))
+        if mp_face_mesh is not None:
+            mp_face_mesh.process(prep.rgb(FACE_INPUT_SIZE))
+    detector([prep.scaled(detector.imgsz)])
+    print(f"[detection] warmup done in {time.time() - t0:.1f}s")
+
+def _buffer(key, shape):
+    """ This thread's array for `key`, reused while the shape stays the same """
+    pool = getattr(_local, "buffers", None)
+    if pool is None:
+        pool = _local.buffers = {}
+    buf = pool.get(key)
+    if buf is None or buf.shape != shape:
+        buf = pool[key] = np.empty(shape, dtype=np.uint8)
+    return buf
+
+class FramePrep:
+    """
+    Preprocessing of one decoded BGR frame, shared by every stage. Each
+    stage asks for the size and colour it needs; every image is computed
+    at most once, smaller levels are resized from the next larger one
+    instead of the full frame, and the arrays are per-thread buffers
+    reused by the next frame (so nothing derived from them may be kept).
+    `slot` separates frames analyzed together on one thread (analyze_batch).
+    """
+
+    def __init__(self, frame, slot: int = 0):
+        self.frame = frame
+        self.height, self.width = frame.shape[:2]
+        self.long_side = max(self.height, self.width)
+        self.slot = slot
+        self.levels = sorted({s for s in (FACE_INPUT_SIZE, detector.imgsz if detector else 0) if s}, reverse=True)
+        self._bgr = {}
+        self._rgb = {}
+
+    def scaled(self, long_side: int):
+        """ BGR frame with its long side at most `long_side` (0 = full size) """
+        if not long_side or long_side >= self.long_side:
+            return self.frame
+        img = self._bgr.get(long_side)
+        if img is None:
+            larger = [s for s in self.levels if long_side < s < self.long_side]
+            src = self.scaled(larger[-1]) if larger else self.frame
+            scale = long_side / self.long_side
+            size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+            img = self._bgr[long_side] = cv2.resize(src, size, dst=_buffer(("bgr", long_side, self.slot), (size[1], size[0], 3)),
+                                                    interpolation=cv2.INTER_AREA)
+        return img
+
+    def rgb(self, long_side: int = 0):
+        """ RGB version of scaled(long_side) """
+        img = self._rgb.get(long_side)
+        if img is None:
+            src = self.scaled(long_side)
+            img = self._rgb[long_side] = cv2.cvtColor(src, cv2.COLOR_BGR2RGB, dst=_buffer(("rgb", long_side, self.slot), src.shape))
+        return img
+
+    def face_crop(self, bbox, margin: float):
+        """ RGB crop of the full-resolution frame around a relative bbox; returns (crop, (x, y, w, h)) in pixels """
+        pad_x, pad_y = bbox.width * margin, bbox.height * margin
+        x0 = int(max(0.0, bbox.xmin - pad_x) * self.width)
+        y0 = int(max(0.0, bbox.ymin - pad_y) * self.height)
+        x1 = int(min(1.0, bbox.xmin + bbox.width + pad_x) * self.width)
+        y1 = int(min(1.0, bbox.ymin + bbox.height + pad_y) * self.height)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None, None
+        crop = cv2.cvtColor(self.frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)  # face-sized, so not pooled
+        return crop, (x0, y0, x1 - x0, y1 - y0)
+
+    def thumbnail(self, size):
+        """ Small grayscale copy (owned by the caller) for frame differencing """
+        small = cv2.resize(self.scaled(self.levels[-1] if self.levels else 0), size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+def get_head_orientation(nose_x: float):
+    """ Rough head orientation check from the nose tip's x (0..1 of frame width): returns left, right, or forward """
+    offset = nose_x - 0.5
+
+    if abs(offset) < 0.15:  # within 15% of center
         return "forward"
     elif offset < 0:
         return "left"
     else:
         return "right"
 
-def analyze_frame(frame):
-    global last_face_detected, focus_away_start
+def head_orientation(prep, face, timings=None):
+    """
+    Orientation of the primary face: from its detection keypoints, or with
+    HEAD_POSE_SOURCE=mesh from FaceMesh run on the face crop only.
+    """
+    if mp_face_mesh is None:
+        return get_head_orientation(face.location_data.relative_keypoints[NOSE_TIP].x)
+
+    crop, roi = prep.face_crop(face.location_data.relative_bounding_box, FACE_ROI_MARGIN)
+    if crop is None:
+        return None
+    with face_lock, stage_timer(timings, "mesh"):
+        mesh_results = mp_face_mesh.process(crop)
+    _count("mesh_run")
+    if not mesh_results.multi_face_landmarks:
+        return None
+    x, _, w, _ = roi
+    nose = mesh_results.multi_face_landmarks[0].landmark[1]  # nose tip
+    return get_head_orientation((x + nose.x * w) / prep.width)
+
+def detect_objects(prep):
+    """ Run YOLO on one frame (batched with other frames when enabled), returns [(label, conf)] """
+    frame = prep.scaled(detector.imgsz)  # already at network size: the letterbox has nothing left to resize
+    if yolo_batcher is not None:
+        return yolo_batcher(frame)
+    return detector([frame])[0]
 
+def worker_stats():
+    """ Stats reported back from inference workers """
+    stats = {"sessions": sessions.stats(), "cascade": cascade_stats(),
+             "detector": detector.describe() if detector is not None else None}
+    if yolo_batcher is not None:
+        stats["yolo_batching"] = yolo_batcher.stats()
+    return stats
+
+def _count(*stages):
+    with stage_lock:
+        stage_counts.update(stages)
+
+def cascade_stats():
+    """ Per-stage run/skip counts and skip rates """
+    with stage_lock:
+        counts = dict(stage_counts)
+    stats = {"enabled": CASCADE_ENABLED, "frames": counts.get("frames", 0)}
+    for stage in ("face", "mesh", "yolo"):
+        ran, skipped = counts.get(f"{stage}_run", 0), counts.get(f"{stage}_skip", 0)
+        stats[stage] = {"run": ran, "skip": skipped,
+                        "skip_rate": skipped / (ran + skipped) if ran + skipped else 0.0}
+    return stats
+
+def motion_score(prep, state):
+    """ Mean absolute difference (0..1) between this frame and the previous one, on a tiny grayscale thumbnail """
+    thumb = prep.thumbnail(MOTION_THUMB_SIZE)
+    prev = state.prev_thumb
+    state.prev_thumb = thumb
+    if prev is None:
+        return 1.0
+    return float(cv2.absdiff(thumb, prev).mean()) / 255.0
+
+SUSPICIOUS_LABELS = ["cell phone", "book", "laptop"]
+
+def analyze_frame(frame, candidate_id: str = "default", now: float = None, objects: list = None,
+                  timings: dict = None, prep: FramePrep = None):
+    """
+    Returns episode records (see episodes.EpisodeTracker): one when a
+    condition starts, periodic progress while it lasts, one when it ends.
+    `now` overrides the wall clock (e.g. video time for recorded videos) and
+    `objects` passes in YOLO results computed elsewhere as (label, conf) pairs.
+    When `timings` is a dict, the seconds spent in each stage are added to it.
+    `prep` passes in the frame's FramePrep when other stages already used it.
+    """
+    load_models()
+    prep = prep or FramePrep(frame)
+    now = time.time() if now is None else now
+    state = sessions.get(candidate_id, now)
+    episodes = state.episodes
     events = []
-    timestamp = time.strftime("%H:%M:%S")
-    frame_h, frame_w = frame.shape[:2]
+    _count("frames")
 
-    # ---------- FACE DETECTION ----------
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = mp_face_detection.process(rgb_frame)
+    # ---------- MOTION GATE ----------
+    # With the cascade on, a static scene reuses the last face/mesh/YOLO
+    # results; the timers below still advance on every frame.
+    run_faces = run_yolo = True
+    if CASCADE_ENABLED:
+        with stage_timer(timings, "motion"):
+            motion = motion_score(prep, state)
+        run_faces = (motion >= MOTION_THRESHOLD or state.face_count is None
+                     or state.frames_since_faces >= FACE_REFRESH_FRAMES)
+        run_yolo = (motion >= YOLO_MOTION_THRESHOLD or state.objects is None
+                    or state.frames_since_yolo >= YOLO_EVERY_N)
 
-    if not results.detections:
-        if time.time() - last_face_detected > 10:
-            events.append({"time": timestamp, "type": "NO_FACE", "details": "No face >10s"})
-        return events
+    # ---------- FACE DETECTION ----------
+    if run_faces:
+        with stage_timer(timings, "preprocess"):
+            face_input = prep.rgb(FACE_INPUT_SIZE)
+        with face_lock, stage_timer(timings, "face"):
+            results = mp_face_detection.process(face_input)
+        faces = results.detections or []
+        state.face_count = len(faces)
+        state.frames_since_faces = 0
+        _count("face_run")
     else:
-        # Update last face seen
-        last_face_detected = time.time()
+        state.frames_since_faces += 1
+        _count("face_skip")
 
-        if len(results.detections) > 1:
-            events.append({"time": timestamp, "type": "MULTIPLE_FACES", "details": "More than 1 face"})
+    with state.lock:
+        if not state.face_count:
+            if run_faces:
+                state.orientation = None
+            if now - state.last_face_detected > 10:
+                events += episodes.observe("NO_FACE", "No face >10s", now)
+            events += episodes.sweep(now)
+            return events
+
+        # Update last face seen
+        state.last_face_detected = now
+        if state.face_count > 1:
+            events += episodes.observe("MULTIPLE_FACES", f"{state.face_count} faces detected", now)
 
     # ---------- HEAD ORIENTATION ----------
-    mesh_results = mp_face_mesh.process(rgb_frame)
-    if mesh_results.multi_face_landmarks:
-        orientation = get_head_orientation(mesh_results.multi_face_landmarks[0].landmark, frame_w, frame_h)
-
-        if orientation == "forward":
-            focus_away_start = None
-        else:
-            if not focus_away_start:
-                focus_away_start = time.time()
-            elif time.time() - focus_away_start > 5:
-                events.append({"time": timestamp, "type": "FOCUS_LOST", "details": f"Looking {orientation} >5s"})
-                focus_away_start = None
+    if run_faces:
+        # The first detection is taken as the candidate's face
+        state.orientation = head_orientation(prep, faces[0], timings)
+    elif mp_face_mesh is not None:
+        _count("mesh_skip")
+
+    orientation = state.orientation
+    if orientation is not None:
+        with state.lock:
+            if orientation == "forward":
+                state.focus_away_start = None
+            else:
+                if not state.focus_away_start:
+                    state.focus_away_start = now
+                elif now - state.focus_away_start > 5:
+                    events += episodes.observe("FOCUS_LOST", f"Looking {orientation} >5s", now,
+                                               key=f"FOCUS_LOST:{orientation}")
 
     # ---------- OBJECT DETECTION ----------
-    yolo_results = yolo(frame, verbose=False)
-    for r in yolo_results:
-        for box in r.boxes:
-            cls_id = int(box.cls[0])
-            label = yolo.names[cls_id]
-            if label in ["cell phone", "book", "laptop"]:
-                events.append({"time": timestamp, "type": "OBJECT_DETECTED", "details": f"{label} detected"})
+    if objects is not None:
+        state.objects = objects
+    elif run_yolo:
+        with stage_timer(timings, "yolo"):
+            state.objects = detect_objects(prep)
+        state.frames_since_yolo = 0
+        _count("yolo_run")
+    else:
+        state.frames_since_yolo += 1
+        _count("yolo_skip")
 
+    with state.lock:
+        for label, conf in state.objects:
+            if label in SUSPICIOUS_LABELS:
+                events += episodes.observe("OBJECT_DETECTED", f"{label} detected", now,
+                                           key=f"OBJECT_DETECTED:{label}", confidence=conf)
+        events += episodes.sweep(now)
+
+    return events
+
+def analyze_batch(frames, candidate_id: str, times):
+    """
+    Analyze consecutive frames of one recording: YOLO runs once on the whole
+    batch, the face stages and timers run per frame at the given times.
+    """
+    load_models()
+    preps = [FramePrep(frame, slot=i) for i, frame in enumerate(frames)]
+    objects = detector([prep.scaled(detector.imgsz) for prep in preps])
+    events = []
+    for prep, t, objs in zip(preps, times, objects):
+        events += analyze_frame(prep.frame, candidate_id, now=t, objects=objs, prep=prep)
     return events
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime
+from bson import ObjectId
+
+# -------------------------
+# Config
+# -------------------------
+EPISODE_CLOSE_AFTER = float(os.getenv("EPISODE_CLOSE_AFTER", 6))     # seconds a condition may be unseen before its episode closes
+EPISODE_UPDATE_EVERY = float(os.getenv("EPISODE_UPDATE_EVERY", 10))  # seconds between progress writes of an open episode
+
+
+def utc(ts: float):
+    return datetime.utcfromtimestamp(ts)
+
+
+class Episode:
+    __slots__ = ("episode_id", "type", "details", "start", "last_seen", "last_written",
+                 "frames", "peak_confidence", "extra")
+
+    def __init__(self, event_type, details, now, confidence=None, extra=None):
+        self.episode_id = str(ObjectId())
+        self.type = event_type
+        self.details = details
+        self.start = now
+        self.last_seen = now
+        self.last_written = now
+        self.frames = 1
+        self.peak_confidence = confidence
+        self.extra = extra
+
+
+class EpisodeTracker:
+    """
+    Turns per-frame observations into episodes.
+
+    An episode opens the first time a condition is observed, its duration,
+    frame count and peak confidence grow while it keeps being observed, and
+    it closes once it has not been observed for `close_after` seconds. Each
+    call returns the records to store: one when the episode opens, one every
+    `update_every` seconds while it is ongoing, and one when it closes. All
+    records of an episode share its episode_id, so the store keeps a single
+    row per episode instead of one per frame.
+    """
+
+    def __init__(self, close_after: float = EPISODE_CLOSE_AFTER, update_every: float = EPISODE_UPDATE_EVERY):
+        self.close_after = close_after
+        self.update_every = update_every
+        self.open = {}  # key -> Episode
+
+    def observe(self, event_type: str, details: str, now: float, key: str = None,
+                confidence: float = None, extra: dict = None):
+        """Record that a condition holds at `now`; `key` separates episodes of one type (e.g. per label)."""
+        key = key or event_type
+        ep = self.open.get(key)
+        if ep is None:
+            ep = Episode(event_type, details, now, confidence, extra)
+            self.open[key] = ep
+            return [self._record(ep, "open")]
+
+        ep.last_seen = now
+        ep.frames += 1
+        ep.details = details
+        if extra:
+            ep.extra = extra
+        if confidence is not None and (ep.peak_confidence is None or confidence > ep.peak_confidence):
+            ep.peak_confidence = confidence
+        if now - ep.last_written >= self.update_every:
+            ep.last_written = now
+            return [self._record(ep, "ongoing")]
+        return []
+
+    def sweep(self, now: float):
+        """Close episodes whose condition has not been seen for `close_after` seconds."""
+        expired = [key for key, ep in self.open.items() if now - ep.last_seen > self.close_after]
+        return [self._record(self.open.pop(key), "closed") for key in expired]
+
+    def close_all(self):
+        records = [self._record(ep, "closed") for ep in self.open.values()]
+        self.open.clear()
+        return records
+
+    def _record(self, ep, status):
+        record = {
+            "episode_id": ep.episode_id,
+            "status": status,
+            "type": ep.type,
+            "details": ep.details,
+            "timestamp": utc(ep.start),
+            "end": utc(ep.last_seen),
+            "duration": round(ep.last_seen - ep.start, 3),
+            "frames": ep.frames,
+            "peak_confidence": ep.peak_confidence,
+        }
+        if ep.extra:
+            record.update(ep.extra)
+        return record
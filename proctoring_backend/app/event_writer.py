@@ -0,0 +1,212 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+from bson import ObjectId
+import db
+from metrics import db_write_seconds, db_written_total, db_dropped_total
+
+# -------------------------
+# Config
+# -------------------------
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 10000))         # events buffered before submit() blocks
+EVENT_SUBMIT_TIMEOUT = float(os.getenv("EVENT_SUBMIT_TIMEOUT", 5.0))  # seconds a blocked submit() waits before dropping the event
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", 500))           # max events per bulk_write
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", 0.5))  # seconds before a partial batch is written
+EVENT_MAX_RETRIES = int(os.getenv("EVENT_MAX_RETRIES", 5))           # attempts per batch on transient errors
+
+DUPLICATE_KEY = 11000
+_STOP = object()
+
+
+class EventWriter:
+    """
+    Buffered writer for the detections collection.
+
+    `submit()` only puts the event on an in-process queue; a background
+    thread writes them with one bulk_write once EVENT_BATCH_SIZE events are
+    waiting or EVENT_FLUSH_INTERVAL has passed; several records of the
+    same episode in one batch are coalesced into the latest one. When the
+    queue is full, `submit()` blocks (backpressure) for up to `timeout`
+    seconds and then drops the event, or raises queue.Full if block=False.
+    Transient Mongo errors are retried with exponential backoff; documents
+    get their _id before the first attempt, so a retried batch never
+    inserts duplicates, and summary updates carry a batch id so they are
+    counted once. A batch that fails for any other reason is dropped
+    and counted; the thread keeps writing the next ones. Once a batch is stored, the per-candidate counts in
+    the summaries collection are incremented for the new events in it.
+    """
+
+    def __init__(self, write_batch=None, write_summary=None, queue_size: int = EVENT_QUEUE_SIZE,
+                 batch_size: int = EVENT_BATCH_SIZE, flush_interval: float = EVENT_FLUSH_INTERVAL,
+                 max_retries: int = EVENT_MAX_RETRIES):
+        self.write_batch = write_batch or db.write_events
+        self.write_summary = write_summary or db.update_summaries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._listeners = []
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.retries = 0
+
+    # -------------------------
+    # Producer side
+    # -------------------------
+    def submit(self, candidate_id: str, event: dict, block: bool = True, timeout: float = EVENT_SUBMIT_TIMEOUT):
+        """Queue one event for writing. Returns False if it was dropped because the queue stayed full."""
+        self.start()
+        try:
+            self._queue.put(db.make_event_doc(candidate_id, event), block=block, timeout=timeout)
+        except queue.Full:
+            if not block:
+                raise
+            self._drop(1, "queue_full")
+            print(f"[event-writer] queue full for {timeout}s, dropping a {event.get('type')} event of {candidate_id}")
+            return False
+        return True
+
+    def flush(self, timeout: float = 10.0):
+        """Block until everything submitted so far has been written (or given up on)."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        return done.wait(timeout)
+
+    def add_listener(self, fn):
+        """Call `fn(candidate_ids)` after every successfully written batch."""
+        self._listeners.append(fn)
+
+    def start(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                    self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """Write what is buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # -------------------------
+    # Writer thread
+    # -------------------------
+    def _run(self):
+        while True:
+            batch, markers, stop = self._collect()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # A bad batch must not stop the thread: submit() would block on a queue nobody drains
+                    print(f"[event-writer] dropping batch of {len(batch)} events: {e!r}")
+                    self._drop(len(batch), "write_error")
+            for done in markers:
+                done.set()
+            if stop:
+                return
+
+    def _collect(self):
+        """Wait for the first item, then gather until the batch is full or the interval has passed."""
+        batch, markers = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                # flush() marker: write what we have now
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, markers, False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, markers, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, markers, False
+
+    def _write(self, batch):
+        increments = db.summary_increments(batch)  # before coalescing: count every episode opened
+        docs = coalesce(batch)
+        with db_write_seconds.time():
+            ok = self._with_retries(lambda: self.write_batch(docs), f"batch of {len(docs)} events")
+        if not ok:
+            self._drop(len(docs), "write_error")
+            return
+        self.written += len(docs)
+        db_written_total.inc(len(docs))
+        self.batches += 1
+        if increments:
+            batch_id = str(ObjectId())  # lets a retried summary update be recognized as already applied
+            self._with_retries(lambda: self.write_summary(increments, batch_id), "summary update")
+
+        candidate_ids = {doc["candidate_id"] for doc in docs}
+        for fn in self._listeners:
+            try:
+                fn(candidate_ids)
+            except Exception as e:
+                print(f"[event-writer] listener failed: {e!r}")
+
+    def _with_retries(self, write, what):
+        delay = 0.1
+        for attempt in range(self.max_retries):
+            try:
+                write()
+                return True
+            except BulkWriteError as e:
+                # Documents already inserted by an earlier attempt are fine
+                errors = e.details.get("writeErrors", [])
+                if all(err.get("code") == DUPLICATE_KEY for err in errors):
+                    return True
+                print(f"[event-writer] dropping {what}: {errors[:1]}")
+                return False
+            except ConnectionFailure as e:
+                self.retries += 1
+                if attempt == self.max_retries - 1:
+                    print(f"[event-writer] dropping {what} after {self.max_retries} attempts: {e}")
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            except PyMongoError as e:
+                # Not transient (auth, validation, write concern, ...): retrying will not help
+                print(f"[event-writer] dropping {what}: {e!r}")
+                return False
+        return False
+
+    def _drop(self, n: int, reason: str):
+        self.dropped += n
+        db_dropped_total.inc(n, reason=reason)
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "batches": self.batches,
+                "retries": self.retries, "dropped": self.dropped}
+
+
+def coalesce(docs):
+    """Keep only the latest document per _id (episode records share theirs)."""
+    latest = {}
+    for doc in docs:
+        latest[doc["_id"]] = doc
+    return list(latest.values())
+
+
+# Shared writer used by the API and the webcam CLI
+event_writer = EventWriter()
+atexit.register(event_writer.close)
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+# -------------------------
+# Config / thresholds
+# -------------------------
+KEYFRAME_INTERVAL = 15      # run the full detector at least every N frames
+MIN_TRACKED_RATIO = 0.5     # re-detect if fewer than this fraction of the keyframe's points are still tracked
+MIN_TRACKED_POINTS = 6      # ... or if fewer than this many points are left
+MAX_TRACK_POINTS = 40
+
+
+class FaceTracker:
+    """
+    Keyframe detection + optical-flow tracking of the primary face.
+
+    MediaPipe face detection runs on keyframes only. In between, corner
+    points inside the last face bbox are followed with pyramidal
+    Lucas-Kanade optical flow and the bbox is shifted by their median
+    motion. A new detection is forced when too many points are lost or
+    every `keyframe_interval` frames. The face count from the last
+    keyframe is kept between detections.
+    """
+
+    def __init__(self, detector, keyframe_interval: int = KEYFRAME_INTERVAL,
+                 min_tracked_ratio: float = MIN_TRACKED_RATIO):
+        self.detector = detector
+        self.keyframe_interval = keyframe_interval
+        self.min_tracked_ratio = min_tracked_ratio
+
+        self.prev_gray = None
+        self.points = None
+        self.keyframe_points = 0    # points found at the last keyframe (the tracked set only shrinks)
+        self.bbox = None            # (x, y, w, h) in pixels
+        self.face_count = 0
+        self.frames_since_keyframe = 0
+        self.keyframes = 0
+        self.tracked_frames = 0
+
+    def update(self, frame):
+        """Return (face_count, face_center_x_norm or None, is_keyframe) for this frame."""
+        frame_w = frame.shape[1]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        tracked = False
+        if (self.points is not None and self.prev_gray is not None
+                and self.frames_since_keyframe < self.keyframe_interval):
+            tracked = self._track(gray)
+
+        self.prev_gray = gray
+        if tracked:
+            self.frames_since_keyframe += 1
+            self.tracked_frames += 1
+            x, y, w, h = self.bbox
+            return self.face_count, (x + w / 2.0) / frame_w, False
+
+        self._detect(frame, gray)
+        self.frames_since_keyframe = 0
+        self.keyframes += 1
+        if self.bbox is None:
+            return self.face_count, None, True
+        x, y, w, h = self.bbox
+        return self.face_count, (x + w / 2.0) / frame_w, True
+
+    def _detect(self, frame, gray):
+        frame_h, frame_w = frame.shape[:2]
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        results = self.detector.process(rgb)
+
+        self.points = None
+        self.bbox = None
+        self.face_count = len(results.detections) if results.detections else 0
+        if not self.face_count:
+            return
+
+        # Track the first face (we assume the candidate is the primary face)
+        bb = results.detections[0].location_data.relative_bounding_box
+        x = int(max(0, bb.xmin) * frame_w)
+        y = int(max(0, bb.ymin) * frame_h)
+        w = int(min(bb.width, 1.0 - max(0, bb.xmin)) * frame_w)
+        h = int(min(bb.height, 1.0 - max(0, bb.ymin)) * frame_h)
+        self.bbox = (x, y, w, h)
+        if w < 8 or h < 8:
+            return
+
+        mask = np.zeros_like(gray)
+        mask[y:y + h, x:x + w] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=MAX_TRACK_POINTS, qualityLevel=0.01,
+                                         minDistance=5, mask=mask)
+        if points is not None and len(points) >= MIN_TRACKED_POINTS:
+            self.points = points
+            self.keyframe_points = len(points)
+
+    def _track(self, gray):
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.points, None,
+                                                         winSize=(15, 15), maxLevel=2)
+        if new_points is None:
+            return False
+        good = status.reshape(-1) == 1
+        n_good = int(good.sum())
+        if n_good < MIN_TRACKED_POINTS or n_good < self.min_tracked_ratio * self.keyframe_points:
+            return False
+
+        shift = np.median(new_points[good] - self.points[good], axis=0).reshape(-1)
+        x, y, w, h = self.bbox
+        self.bbox = (x + float(shift[0]), y + float(shift[1]), w, h)
+        self.points = new_points[good].reshape(-1, 1, 2)
+        return True
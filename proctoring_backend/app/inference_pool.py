@@ -0,0 +1,482 @@
+import os
+import sys
+import time
+import asyncio
+import itertools
+import zlib
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import cv2
+import numpy as np
+from batching import merge_batch_stats
+from metrics import stage_timer, observe_stages, SamplingProfiler
+from session_state import SESSION_SWEEP_INTERVAL
+
+# -------------------------
+# Config
+# -------------------------
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", os.cpu_count() or 1))  # 0 = run in the API process
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 64))   # max frames queued + running
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 30))       # seconds to wait for one frame
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", 1))          # frames in flight per worker (feeds YOLO batching)
+INFERENCE_ROUTING = os.getenv("INFERENCE_ROUTING", "affinity")      # "affinity" (same candidate -> same worker) or "least_loaded"
+INFERENCE_WARMUP = os.getenv("INFERENCE_WARMUP", "1") == "1"        # load models + run a dummy frame before reporting ready
+INFERENCE_CPU_THREADS = int(os.getenv("INFERENCE_CPU_THREADS", 0))  # torch/OpenCV/OpenMP threads per worker (0 = cores / workers)
+INFERENCE_RESPAWN_MAX_DELAY = float(os.getenv("INFERENCE_RESPAWN_MAX_DELAY", 60))  # seconds between restarts of a crashing worker, at most
+MONITOR_INTERVAL = 1.0  # seconds between worker liveness checks
+CLOSED_EPISODES = "closed"  # task_id of worker messages carrying episode records closed by a session sweep
+
+
+class PoolBusy(Exception):
+    """Raised when the inference queue is full and a frame cannot be accepted."""
+
+
+def decode_frame(payload: bytes):
+    """Decode JPEG/PNG bytes into a BGR image (None if the bytes are not an image)."""
+    np_arr = np.frombuffer(payload, np.uint8)
+    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+
+def _process_task(candidate_id: str, payload: bytes, profile: bool = False):
+    """
+    Decode and analyze one frame; returns (events, worker stats snapshot,
+    per-stage timings, sampled profile or None).
+    """
+    from detection import analyze_frame, worker_stats
+
+    timings = {}
+    with stage_timer(timings, "decode"):
+        frame = decode_frame(payload)
+    if frame is None:
+        raise ValueError("Could not decode frame")
+    profiler = SamplingProfiler() if profile else nullcontext()
+    with stage_timer(timings, "analyze"), profiler:
+        events = analyze_frame(frame, candidate_id, timings=timings)
+    return events, worker_stats(), timings, profiler.top() if profile else None
+
+
+def _worker_loop(inbox, outbox):
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+        task_id, candidate_id, payload, profile = task
+        try:
+            outbox.put((task_id, True, _process_task(candidate_id, payload, profile)))
+        except ValueError as e:  # bad input (e.g. undecodable frame)
+            outbox.put((task_id, False, ValueError(str(e))))
+        except Exception as e:
+            outbox.put((task_id, False, RuntimeError(repr(e))))
+
+
+def _closed_sessions(final: bool = False):
+    """
+    [(candidate_id, records)] for episodes closed by a session sweep or, with
+    `final`, of every session. Nothing to close before detection is loaded.
+    """
+    detection = sys.modules.get("detection")
+    if detection is None:
+        return []
+    return detection.sessions.close_all() if final else detection.sessions.sweep()
+
+
+def _sweep_loop(outbox, stop):
+    while not stop.wait(SESSION_SWEEP_INTERVAL):
+        closed = _closed_sessions()
+        if closed:
+            outbox.put((CLOSED_EPISODES, True, closed))
+
+
+def _warmup(enabled: bool = True):
+    """Load the models and run a dummy frame (or, disabled, defer both to the first real frame)."""
+    if enabled:
+        from detection import warmup
+        warmup()
+
+
+def _limit_cpu_threads(n: int):
+    """Cap the math libraries' thread pools, so N workers do not each start one thread per core."""
+    os.environ["OMP_NUM_THREADS"] = str(n)  # before torch is imported (detection imports it lazily)
+    cv2.setNumThreads(n)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(n)
+
+
+def _worker_main(inbox, outbox, worker_id, generation=0, threads=1, warmup=True, cpu_threads=1):
+    """
+    Entry point of a worker process. With `warmup` the models are loaded and
+    exercised once before the worker reports ready, then `threads` threads
+    process frames until each gets a None sentinel. Several threads per
+    worker keep more than one frame in flight, which is what lets the YOLO
+    micro-batcher form batches.
+    Messages sent back are (task_id, ok, result); task_id None is a status
+    message: ok with (worker_id, generation) means "ready", not ok with
+    (worker_id, generation, error) means warmup failed and the worker exits.
+    CLOSED_EPISODES messages carry the records of episodes closed because
+    their candidate stopped sending frames, and of every open episode when
+    the worker shuts down.
+    """
+    _limit_cpu_threads(cpu_threads)
+    try:
+        _warmup(warmup)
+    except Exception as e:
+        outbox.put((None, False, (worker_id, generation, RuntimeError(repr(e)))))
+        return
+    outbox.put((None, True, (worker_id, generation)))
+    stop = threading.Event()
+    threading.Thread(target=_sweep_loop, args=(outbox, stop), daemon=True).start()
+    loops = [threading.Thread(target=_worker_loop, args=(inbox, outbox), daemon=True)
+             for _ in range(max(1, threads))]
+    for t in loops:
+        t.start()
+    for t in loops:
+        t.join()
+    stop.set()
+    closed = _closed_sessions(final=True)
+    if closed:
+        outbox.put((CLOSED_EPISODES, True, closed))
+
+
+def merge_cascade_stats(stats_list):
+    """Sum detection.cascade_stats() snapshots from several workers."""
+    merged = {"frames": sum(s["frames"] for s in stats_list)}
+    for stage in ("face", "mesh", "yolo"):
+        ran = sum(s[stage]["run"] for s in stats_list)
+        skipped = sum(s[stage]["skip"] for s in stats_list)
+        merged[stage] = {"run": ran, "skip": skipped,
+                         "skip_rate": skipped / (ran + skipped) if ran + skipped else 0.0}
+    return merged
+
+
+def _resolve(fut, ok, result):
+    if fut.done():  # request was cancelled or timed out
+        return
+    if ok:
+        fut.set_result(result)
+    else:
+        fut.set_exception(result)
+
+
+class InferencePool:
+    """
+    Pool of worker processes running `detection.analyze_frame`.
+
+    Each worker loads the models once. `submit()` is awaited from the API
+    handlers, so inference never runs on the event loop. The number of
+    frames queued or running is bounded by `queue_size`; beyond that
+    `submit()` raises PoolBusy instead of letting latency grow.
+
+    With "affinity" routing every frame of a candidate goes to the same
+    worker, so the per-candidate detector state in that worker's
+    SessionStore stays consistent without any shared store.
+
+    A monitor thread watches the worker processes. When one exits (crash,
+    OOM kill, failed warmup) its pending frames fail at once, it stops
+    counting as ready, frames routed to it raise PoolBusy, and it is
+    restarted with a backoff that doubles up to INFERENCE_RESPAWN_MAX_DELAY.
+
+    Episodes closed outside a frame (the candidate stopped sending frames,
+    or shutdown) are passed to `on_episodes_closed(candidate_id, records)`.
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE,
+                 timeout: float = INFERENCE_TIMEOUT, threads: int = INFERENCE_THREADS,
+                 routing: str = INFERENCE_ROUTING, warmup: bool = INFERENCE_WARMUP,
+                 cpu_threads: int = INFERENCE_CPU_THREADS):
+        if routing not in ("affinity", "least_loaded"):
+            raise ValueError(f"Unknown routing mode: {routing}")
+        self.workers = workers
+        self.routing = routing
+        self.threads = max(1, threads)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.warmup = warmup
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}          # task_id -> (loop, future, worker index)
+        self._worker_depth = [0] * max(workers, 1)
+        self._inboxes = []
+        self._processes = []
+        self._generations = []      # worker index -> spawn count, to ignore messages of a replaced process
+        self._ready = []            # worker index -> models loaded
+        self._respawn_at = []       # worker index -> monotonic time of the next restart (while down)
+        self._respawn_delay = []
+        self._ctx = None
+        self._outbox = None
+        self._reader = None
+        self._monitor = None
+        self._stopping = threading.Event()
+        self._executor = None
+        self._sweeper = None
+        self._worker_stats = {}     # worker index -> latest detection.worker_stats()
+
+        self.ready_workers = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.on_episodes_closed = None
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+    def start(self):
+        if self.workers <= 0:
+            # In-process mode (dev / debugging)
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="inference")
+            self._executor.submit(_warmup, self.warmup).add_done_callback(self._warmed_up)
+            self._sweeper = threading.Thread(target=self._sweep_in_process, name="session-sweep", daemon=True)
+            self._sweeper.start()
+            return
+
+        self._ctx = mp.get_context("spawn")
+        self._outbox = self._ctx.Queue()
+        self._inboxes = [None] * self.workers
+        self._processes = [None] * self.workers
+        self._generations = [0] * self.workers
+        self._ready = [False] * self.workers
+        self._respawn_at = [None] * self.workers
+        self._respawn_delay = [1.0] * self.workers
+        for i in range(self.workers):
+            self._spawn(i)
+
+        self._reader = threading.Thread(target=self._read_results, name="inference-results", daemon=True)
+        self._reader.start()
+        self._monitor = threading.Thread(target=self._watch_workers, name="inference-monitor", daemon=True)
+        self._monitor.start()
+
+    def _spawn(self, i: int):
+        """Start worker `i` with a fresh inbox (a killed process can leave the old queue unusable)."""
+        inbox = self._ctx.Queue()
+        with self._lock:
+            self._generations[i] += 1
+            generation = self._generations[i]
+            self._inboxes[i] = inbox
+        p = self._ctx.Process(target=_worker_main,
+                              args=(inbox, self._outbox, i, generation, self.threads, self.warmup, self.cpu_threads),
+                              name=f"inference-{i}", daemon=True)
+        p.start()
+        self._processes[i] = p
+        self._respawn_at[i] = None
+
+    def _warmed_up(self, fut):
+        if fut.exception() is not None:
+            print(f"[inference] warmup failed: {fut.exception()!r}")
+            return
+        self.ready_workers = 1
+
+    @property
+    def ready(self):
+        """True once every worker has its models loaded (and warmed up)."""
+        return self.ready_workers >= max(self.workers, 1)
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._sweeper.join(timeout=5)
+            self._episodes_closed(_closed_sessions(final=True))
+            return
+        if self._monitor is not None:
+            self._monitor.join(timeout=5)
+        for inbox in self._inboxes:
+            for _ in range(self.threads):
+                inbox.put(None)
+        for p in self._processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        if self._outbox is not None:
+            self._outbox.put(None)
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+
+    def _read_results(self):
+        while True:
+            msg = self._outbox.get()
+            if msg is None:
+                break
+            task_id, ok, result = msg
+            if task_id == CLOSED_EPISODES:
+                self._episodes_closed(result)
+                continue
+            if task_id is None:
+                self._worker_status(ok, result)
+                continue
+            with self._lock:
+                entry = self._pending.pop(task_id, None)
+                if entry is not None:
+                    self._worker_depth[entry[2]] -= 1
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+            if entry is not None:
+                loop, fut, worker = entry
+                if ok:
+                    result = self._unpack(worker, result)
+                loop.call_soon_threadsafe(_resolve, fut, ok, result)
+
+    def _worker_status(self, ok, result):
+        worker, generation = result[:2]
+        with self._lock:
+            if generation != self._generations[worker]:
+                return  # from a process that has since been replaced
+            if ok:
+                self._ready[worker] = True
+                self._respawn_delay[worker] = 1.0
+                self.ready_workers = sum(self._ready)
+        if not ok:
+            print(f"[inference] worker {worker} failed to warm up: {result[2]!r}")
+
+    def _sweep_in_process(self):
+        while not self._stopping.wait(SESSION_SWEEP_INTERVAL):
+            self._episodes_closed(_closed_sessions())
+
+    def _episodes_closed(self, closed):
+        if self.on_episodes_closed is None:
+            return
+        for candidate_id, records in closed:
+            try:
+                self.on_episodes_closed(candidate_id, records)
+            except Exception as e:
+                print(f"[inference] storing closed episodes of {candidate_id} failed: {e!r}")
+
+    # -------------------------
+    # Supervision
+    # -------------------------
+    def _watch_workers(self):
+        while not self._stopping.wait(MONITOR_INTERVAL):
+            for i, p in enumerate(self._processes):
+                if self._respawn_at[i] is None and not p.is_alive():
+                    self._worker_died(i, p.exitcode)
+                if self._respawn_at[i] is not None and time.monotonic() >= self._respawn_at[i]:
+                    self.restarts += 1
+                    print(f"[inference] restarting worker {i}")
+                    self._spawn(i)
+
+    def _worker_died(self, i: int, exitcode):
+        """Fail the frames worker `i` held and schedule its restart."""
+        with self._lock:
+            self._ready[i] = False
+            self.ready_workers = sum(self._ready)
+            lost = [(task_id, entry) for task_id, entry in self._pending.items() if entry[2] == i]
+            for task_id, _ in lost:
+                del self._pending[task_id]
+            self._worker_depth[i] -= len(lost)
+            self.failed += len(lost)
+            delay = self._respawn_delay[i]
+            self._respawn_delay[i] = min(delay * 2, INFERENCE_RESPAWN_MAX_DELAY)
+            self._respawn_at[i] = time.monotonic() + delay
+        print(f"[inference] worker {i} exited (code {exitcode}), {len(lost)} frames failed, restarting in {delay:.0f}s")
+        for _, (loop, fut, _) in lost:
+            loop.call_soon_threadsafe(_resolve, fut, False, RuntimeError(f"Inference worker {i} exited"))
+
+    # -------------------------
+    # Submission
+    # -------------------------
+    def _route(self, candidate_id: str):
+        if self.routing == "affinity":
+            # crc32 rather than hash(): stable across processes and restarts
+            return zlib.crc32(candidate_id.encode("utf-8")) % len(self._worker_depth)
+        up = [i for i in range(len(self._worker_depth)) if not self._respawn_at or self._respawn_at[i] is None]
+        return min(up or range(len(self._worker_depth)), key=self._worker_depth.__getitem__)
+
+    def _reserve(self, loop, candidate_id: str):
+        """Allocate a task slot on the routed worker or raise PoolBusy."""
+        with self._lock:
+            if len(self._pending) >= self.queue_size:
+                self.rejected += 1
+                raise PoolBusy(f"Inference queue full ({self.queue_size} frames)")
+            worker = self._route(candidate_id)
+            if self._respawn_at and self._respawn_at[worker] is not None:
+                self.rejected += 1
+                raise PoolBusy(f"Inference worker {worker} is restarting")
+            task_id = next(self._ids)
+            fut = loop.create_future()
+            self._pending[task_id] = (loop, fut, worker)
+            self._worker_depth[worker] += 1
+        return task_id, fut, worker
+
+    def _unpack(self, worker, result):
+        events, worker_stats, timings, profile = result
+        self._worker_stats[worker] = worker_stats
+        observe_stages(timings)
+        return events, profile
+
+    def _release(self, task_id, ok=True):
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            if entry is None:
+                return
+            self._worker_depth[entry[2]] -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    async def submit(self, candidate_id: str, payload: bytes, profile: dict = None):
+        """
+        Run detection on a candidate's encoded frame bytes and return the list
+        of events. When `profile` is a dict, the frame is analyzed under the
+        sampling profiler and the result is stored in it.
+        """
+        loop = asyncio.get_running_loop()
+        task_id, fut, worker = self._reserve(loop, candidate_id)
+
+        if self._executor is not None:
+            ok = False
+            try:
+                result = await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, _process_task, candidate_id, payload, profile is not None),
+                    self.timeout)
+                ok = True
+                events, sampled = self._unpack(worker, result)
+            finally:
+                self._release(task_id, ok)
+        else:
+            self._inboxes[worker].put((task_id, candidate_id, payload, profile is not None))
+            try:
+                events, sampled = await asyncio.wait_for(fut, self.timeout)
+            except asyncio.TimeoutError:
+                self._release(task_id, ok=False)
+                raise
+        if profile is not None and sampled:
+            profile.update(sampled)
+        return events
+
+    # -------------------------
+    # Stats
+    # -------------------------
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        snapshots = list(self._worker_stats.values())
+        batching = [s["yolo_batching"] for s in snapshots if "yolo_batching" in s]
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads,
+                "routing": self.routing,
+                "ready_workers": self.ready_workers,
+                "restarts": self.restarts,
+                "queue_depth": len(self._pending),
+                "queue_capacity": self.queue_size,
+                "per_worker_depth": list(self._worker_depth),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "sessions": sum(s["sessions"]["sessions"] for s in snapshots),
+                "cascade": merge_cascade_stats([s["cascade"] for s in snapshots]) if snapshots else None,
+                "yolo_batching": merge_batch_stats(batching) if batching else None,
+                "detector": snapshots[0]["detector"] if snapshots else None,
+            }
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+
+
+class LogBroadcaster:
+    """
+    Wakes up /logs stream subscribers when new events for their candidate
+    have been written.
+
+    `notify()` is called from the event writer thread after each batch; it
+    only sets an asyncio.Event on each subscriber's loop. Subscribers then
+    fetch the new events themselves with the cursor they already hold.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # candidate_id -> set of (loop, asyncio.Event)
+
+    def subscribe(self, candidate_id: str):
+        entry = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._subscribers.setdefault(candidate_id, set()).add(entry)
+        return entry
+
+    def unsubscribe(self, candidate_id: str, entry):
+        with self._lock:
+            subs = self._subscribers.get(candidate_id)
+            if subs is not None:
+                subs.discard(entry)
+                if not subs:
+                    del self._subscribers[candidate_id]
+
+    def notify(self, candidate_ids):
+        with self._lock:
+            entries = [e for cid in set(candidate_ids) for e in self._subscribers.get(cid, ())]
+        for loop, event in entries:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # loop already closed
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+log_broadcaster = LogBroadcaster()
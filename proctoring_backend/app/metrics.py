@@ -0,0 +1,232 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# -------------------------
+# Config
+# -------------------------
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"          # allow ?profile=1 on /analyze
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.002))        # seconds between stack samples
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 30))                       # stacks returned per profiled request
+
+# Seconds; detection stages run from ~1 ms (decode) to ~1 s (YOLO on a cold CPU)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# -------------------------
+# Metric types (Prometheus text format)
+# -------------------------
+class CounterMetric:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = Counter()  # label values -> count
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in items]
+        return lines
+
+
+class HistogramMetric:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class GaugeMetric:
+    """A value read at scrape time from `fn` (a number, or a dict of label value -> number)."""
+
+    def __init__(self, name: str, help: str, fn, labelname: str = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"[metrics] gauge {self.name} failed: {e!r}")
+            return lines
+        if isinstance(value, dict):
+            lines += [f"{self.name}{_labels((self.labelname,), (k,))} {v}" for k, v in sorted(value.items())]
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labelnames=()):
+        return self._add(CounterMetric(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(HistogramMetric(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn, labelname: str = None):
+        return self._add(GaugeMetric(name, help, fn, labelname))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# -------------------------
+# API process metrics (worker processes send their stage timings back with each result)
+# -------------------------
+stage_seconds = registry.histogram(
+    "proctoring_stage_seconds", "Time spent per /analyze stage", ["stage"])
+frames_total = registry.counter(
+    "proctoring_frames_total", "Frames received by /analyze, by outcome", ["result"])
+events_total = registry.counter(
+    "proctoring_events_total", "Episode records produced, by type and status (open/ongoing/closed)", ["type", "status"])
+request_seconds = registry.histogram(
+    "proctoring_http_request_seconds", "HTTP request latency", ["method", "route", "status"])
+db_write_seconds = registry.histogram(
+    "proctoring_db_write_seconds", "Latency of one event batch bulk write (including retries)")
+db_written_total = registry.counter(
+    "proctoring_db_events_written_total", "Event documents written to Mongo")
+db_dropped_total = registry.counter(
+    "proctoring_db_events_dropped_total", "Event documents given up on, by reason (write_error/queue_full)", ["reason"])
+
+
+def observe_stages(timings: dict):
+    """Record a {stage: seconds} dict (see stage_timer) in proctoring_stage_seconds."""
+    if timings:
+        for stage, seconds in timings.items():
+            stage_seconds.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(timings, stage: str):
+    """Add the time spent in the block to timings[stage]; does nothing when timings is None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+# -------------------------
+# Sampling profiler
+# -------------------------
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds from a helper
+    thread, so the profiled code runs unmodified. `top()` returns the most
+    frequent stacks in collapsed "outer;...;inner" form (flamegraph input).
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def top(self, n: int = PROFILE_TOP):
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(n)],
+        }
@@ -0,0 +1,308 @@
+# object_detector.py
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import argparse
+from contextlib import contextmanager
+from ultralytics import YOLO
+
+# -------------------------
+# Config
+# -------------------------
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "torch")           # torch | onnx | openvino
+DETECTOR_MODEL = os.getenv("DETECTOR_MODEL", "yolov8n.pt")          # PyTorch weights (exports are derived from them)
+DETECTOR_IMGSZ = int(os.getenv("DETECTOR_IMGSZ", 640))              # network input size; 320-416 is much cheaper on CPU
+DETECTOR_INT8 = os.getenv("DETECTOR_INT8", "0") == "1"              # INT8-quantized export (onnx / openvino)
+DETECTOR_CLASSES = os.getenv("DETECTOR_CLASSES", "cell phone,book,laptop")  # labels to keep; "all" = every class
+DETECTOR_CONF = float(os.getenv("DETECTOR_CONF", 0.25))             # minimum box confidence
+DETECTOR_EXPORT_DIR = os.getenv("DETECTOR_EXPORT_DIR", "models")    # exported models are cached here
+DETECTOR_CALIBRATION = os.getenv("DETECTOR_CALIBRATION", "")       # INT8 only: directory of recorded interview frames
+CALIBRATION_IMAGES = 200                                            # most images used to calibrate ONNX INT8
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+
+def parse_classes(value: str):
+    """'cell phone,book' -> ['cell phone', 'book']; '' / 'all' -> None (no filtering)."""
+    labels = [c.strip() for c in (value or "").split(",") if c.strip()]
+    return None if not labels or labels == ["all"] else labels
+
+
+# -------------------------
+# Export
+# -------------------------
+def export_path(model: str, backend: str, imgsz: int, int8: bool):
+    stem = os.path.splitext(os.path.basename(model))[0]
+    name = f"{stem}_{imgsz}{'_int8' if int8 else ''}"
+    if backend == "onnx":
+        return os.path.join(DETECTOR_EXPORT_DIR, f"{name}.onnx")
+    return os.path.join(DETECTOR_EXPORT_DIR, f"{name}_openvino_model")
+
+
+@contextmanager
+def _export_lock(path: str):
+    """Every inference worker loads the model at start-up; only one of them should export it."""
+    os.makedirs(DETECTOR_EXPORT_DIR, exist_ok=True)
+    with open(f"{path}.lock", "w") as f:
+        try:
+            import fcntl
+        except ImportError:  # Windows: exports are rare enough to go unguarded
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def export_model(model: str = DETECTOR_MODEL, backend: str = DETECTOR_BACKEND, imgsz: int = DETECTOR_IMGSZ,
+                 int8: bool = DETECTOR_INT8):
+    """
+    Export the PyTorch weights for an ONNX Runtime or OpenVINO backend (once;
+    later calls return the cached export). Exports use dynamic batch so the
+    YOLO micro-batcher and post-hoc analysis can send several frames at once.
+    INT8 is calibrated on the frames in DETECTOR_CALIBRATION, which must be
+    recorded from real interviews (webcam, lighting, phones held in hand):
+    a handful of generic images gives activation ranges that lose accuracy.
+    ONNX gets static QDQ quantization (dynamic quantization's ConvInteger ops
+    are often slower than FP32 on CPU), OpenVINO uses ultralytics' NNCF calibration.
+    """
+    if backend not in ("onnx", "openvino"):
+        raise ValueError(f"Nothing to export for backend {backend!r}")
+    target = export_path(model, backend, imgsz, int8)
+    with _export_lock(target):
+        if os.path.exists(target):
+            return target
+        frames = calibration_images() if int8 else None  # fail before the export, not after it
+        print(f"[detector] exporting {model} -> {target}")
+        if backend == "onnx":
+            exported = YOLO(model).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                _quantize_onnx(exported, target, imgsz, frames)
+                os.remove(exported)
+            else:
+                shutil.move(exported, target)
+        else:
+            yolo = YOLO(model)
+            data = _calibration_yaml(target, yolo.names) if int8 else None
+            try:
+                exported = yolo.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8,
+                                       **({"data": data} if int8 else {}))
+            finally:
+                if data:
+                    os.remove(data)
+            shutil.move(exported, target)
+    return target
+
+
+def calibration_images(source: str = DETECTOR_CALIBRATION, limit: int = CALIBRATION_IMAGES):
+    """Image paths for INT8 calibration, from a directory of recorded interview frames."""
+    if not source or not os.path.isdir(source):
+        raise ValueError("INT8 needs DETECTOR_CALIBRATION: a directory of frames recorded from real interviews "
+                         f"(`python object_detector.py frames <video> <dir>`), got {source!r}")
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(source, "**", f"*.{ext}"), recursive=True))
+    if not paths:
+        raise ValueError(f"No calibration images in {source}")
+    return paths[:limit]
+
+
+def _head_nodes(onnx_path: str):
+    """Nodes of the last module (the Detect head): its box decoding loses too much accuracy in INT8."""
+    import onnx
+
+    names = [node.name for node in onnx.load(onnx_path).graph.node]
+    modules = [int(m.group(1)) for m in (re.match(r"/model\.(\d+)/", n) for n in names) if m]
+    if not modules:
+        return []
+    prefix = f"/model.{max(modules)}/"
+    return [n for n in names if n.startswith(prefix)]
+
+
+def _calibration_yaml(target: str, names: dict, source: str = DETECTOR_CALIBRATION):
+    """A one-off ultralytics dataset yaml over the calibration frames (OpenVINO's NNCF export only takes a yaml)."""
+    path = f"{target}.calibration.yaml"
+    with open(path, "w") as f:  # JSON is valid YAML
+        json.dump({"path": os.path.abspath(source), "train": ".", "val": ".", "names": names}, f)
+    return path
+
+
+def _quantize_onnx(exported: str, target: str, imgsz: int, frames: list):
+    """Static QDQ INT8 quantization, activations calibrated on frames letterboxed the way inference sees them."""
+    import cv2
+    import numpy as np
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+    from ultralytics.data.augment import LetterBox
+
+    input_name = ort.InferenceSession(exported, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)
+
+    class Frames(CalibrationDataReader):
+        def __init__(self, paths):
+            self.paths = iter(paths)
+
+        def get_next(self):
+            for path in self.paths:
+                frame = cv2.imread(path)
+                if frame is None:
+                    continue
+                img = letterbox(image=frame)[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+                return {input_name: np.ascontiguousarray(img, dtype=np.float32)[None] / 255.0}
+            return None
+
+    quantize_static(exported, target, Frames(frames), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+                    nodes_to_exclude=_head_nodes(exported))
+
+
+# -------------------------
+# Detector
+# -------------------------
+class ObjectDetector:
+    """
+    YOLO object detector behind one interface for every backend.
+
+    Calling it with a list of BGR frames returns, per frame, a list of
+    (label, confidence) pairs. Only `classes` are kept, and they are
+    filtered inside NMS rather than afterwards, so the other 77 COCO
+    classes cost nothing downstream. Frames are letterboxed to `imgsz`.
+    """
+
+    def __init__(self, backend: str = DETECTOR_BACKEND, model: str = DETECTOR_MODEL, imgsz: int = DETECTOR_IMGSZ,
+                 int8: bool = DETECTOR_INT8, classes=parse_classes(DETECTOR_CLASSES), conf: float = DETECTOR_CONF):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown detector backend: {backend}")
+        if int8 and backend == "torch":
+            raise ValueError("INT8 needs the onnx or openvino backend")
+        self.backend = backend
+        self.imgsz = imgsz
+        self.int8 = int8
+        self.conf = conf
+        path = model if backend == "torch" else export_model(model, backend, imgsz, int8)
+        self.model = YOLO(path, task="detect")
+        self.names = self.model.names
+        self.class_ids = None
+        if classes:
+            self.class_ids = [i for i, name in self.names.items() if name in classes]
+            missing = set(classes) - {self.names[i] for i in self.class_ids}
+            if missing:
+                raise ValueError(f"Model has no classes {sorted(missing)}")
+
+    def __call__(self, frames):
+        results = self.model(frames, imgsz=self.imgsz, conf=self.conf, classes=self.class_ids, verbose=False)
+        return [[(self.names[int(c)], float(p)) for c, p in zip(r.boxes.cls.tolist(), r.boxes.conf.tolist())]
+                for r in results]
+
+    def describe(self):
+        return {"backend": self.backend, "imgsz": self.imgsz, "int8": self.int8, "conf": self.conf,
+                "classes": [self.names[i] for i in self.class_ids] if self.class_ids else "all"}
+
+
+# -------------------------
+# Accuracy / latency comparison
+# -------------------------
+def _frames(video: str, limit: int):
+    import cv2
+
+    cap = cv2.VideoCapture(video)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or limit
+    step = max(1, total // limit)
+    frames, i = [], 0
+    while len(frames) < limit and cap.grab():
+        if i % step == 0:
+            ok, frame = cap.retrieve()
+            if ok:
+                frames.append(frame)
+        i += 1
+    cap.release()
+    return frames
+
+
+def compare(frames, configs, reference: dict, runs: int = 1):
+    """
+    Run every detector config on the same frames. Latency is per frame;
+    accuracy is label agreement with `reference` (the PyTorch model at full
+    size): a (frame, label) pair found by both counts as a hit.
+    """
+    ref = ObjectDetector(**reference)
+    truth = [{label for label, _ in objs} for objs in ref(frames)]
+    rows = []
+    for config in configs:
+        det = ObjectDetector(**config)
+        det(frames[:1])  # warm-up
+        latencies, found = [], None
+        for _ in range(runs):
+            found = []
+            for frame in frames:
+                t0 = time.perf_counter()
+                found.append({label for label, _ in det([frame])[0]})
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+        hits = sum(len(f & t) for f, t in zip(found, truth))
+        predicted, expected = sum(len(f) for f in found), sum(len(t) for t in truth)
+        latencies.sort()
+        rows.append({
+            **det.describe(),
+            "p50_ms": latencies[len(latencies) // 2],
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            "precision": hits / predicted if predicted else 1.0,
+            "recall": hits / expected if expected else 1.0,
+        })
+    return rows
+
+
+# -------------------------
+# CLI
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export detector backends or compare their accuracy and latency")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="Export the model for a backend (cached in DETECTOR_EXPORT_DIR)")
+    exp.add_argument("--backend", choices=("onnx", "openvino"), default="onnx")
+    exp.add_argument("--imgsz", type=int, default=DETECTOR_IMGSZ)
+    exp.add_argument("--int8", action="store_true")
+
+    frm = sub.add_parser("frames", help="Save frames sampled from a recorded interview (INT8 calibration data)")
+    frm.add_argument("video", help="Recorded interview video to sample frames from")
+    frm.add_argument("out", help="Directory to write the frames to (use it as DETECTOR_CALIBRATION)")
+    frm.add_argument("--frames", type=int, default=CALIBRATION_IMAGES)
+
+    cmp = sub.add_parser("compare", help="Accuracy/latency of backend x imgsz x int8 on recorded frames")
+    cmp.add_argument("video", help="Recorded interview video to sample frames from")
+    cmp.add_argument("--frames", type=int, default=100, help="Frames sampled from the video")
+    cmp.add_argument("--backends", default="torch,onnx,openvino")
+    cmp.add_argument("--imgsz", default="640,416,320", help="Comma-separated input sizes")
+    cmp.add_argument("--int8", action="store_true", help="Also compare INT8 exports")
+    cmp.add_argument("--runs", type=int, default=1, help="Passes over the frames per config")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_model(DETECTOR_MODEL, args.backend, args.imgsz, args.int8))
+    elif args.command == "frames":
+        import cv2
+
+        os.makedirs(args.out, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(args.video))[0]
+        frames = _frames(args.video, args.frames)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(args.out, f"{stem}_{i:04d}.jpg"), frame)
+        print(f"{len(frames)} frames written to {args.out}")
+    else:
+        frames = _frames(args.video, args.frames)
+        if not frames:
+            parser.error(f"could not read frames from {args.video}")
+        classes = parse_classes(DETECTOR_CLASSES)
+        configs = []
+        for backend in args.backends.split(","):
+            for imgsz in map(int, args.imgsz.split(",")):
+                for int8 in ((False, True) if args.int8 and backend != "torch" else (False,)):
+                    configs.append({"backend": backend, "imgsz": imgsz, "int8": int8, "classes": classes})
+        rows = compare(frames, configs, {"backend": "torch", "imgsz": 640, "classes": classes}, args.runs)
+        print(f"{'backend':<10}{'imgsz':>6}{'int8':>6}{'p50 ms':>10}{'p99 ms':>10}{'precision':>11}{'recall':>8}")
+        for r in rows:
+            print(f"{r['backend']:<10}{r['imgsz']:>6}{str(r['int8']):>6}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+                  f"{r['precision']:>11.2f}{r['recall']:>8.2f}")
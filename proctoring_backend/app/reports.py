@@ -0,0 +1,156 @@
+import os
+import io
+import csv
+import glob
+import time
+import hashlib
+import threading
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from datetime import datetime
+from db import iter_events, summary_counts
+
+# -------------------------
+# Config
+# -------------------------
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "reports")
+CSV_CHUNK_ROWS = 500        # rows per chunk sent to the client
+CSV_FIELDS = ["timestamp", "end", "type", "details", "status", "duration", "frames", "peak_confidence"]
+REPORT_KEEP_SECONDS = int(os.getenv("REPORT_KEEP_SECONDS", 300))  # superseded reports handed out this recently are kept
+PDF_MAX_ROWS = int(os.getenv("PDF_MAX_ROWS", 20000))    # events listed in the PDF (reportlab holds every page until save)
+
+# Reports are cached per candidate under the cursor of the last change
+# in their log (db.get_log_cursor): a new or updated event changes the
+# cursor, so a cached file is never stale, and a finished interview is
+# rendered once. A replaced report is only deleted once it has not been
+# handed out for REPORT_KEEP_SECONDS, so a response still sending it keeps
+# its file.
+
+
+def _fmt(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _candidate_dir(candidate_id: str):
+    # Hashed: candidate ids come from clients, and no id (not even "..") may name another directory
+    return os.path.join(REPORT_CACHE_DIR, hashlib.sha1(candidate_id.encode("utf-8")).hexdigest())
+
+
+def cached_report(candidate_id: str, cursor: str, ext: str):
+    """Path of the cached report for this cursor, or None if it has not been rendered yet."""
+    path = os.path.join(_candidate_dir(candidate_id), f"{cursor}.{ext}")
+    try:
+        os.utime(path)  # mtime = last handed out (see _publish)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def _tmp_path(candidate_id: str, cursor: str, ext: str):
+    os.makedirs(_candidate_dir(candidate_id), exist_ok=True)
+    final = os.path.join(_candidate_dir(candidate_id), f"{cursor}.{ext}")
+    return final, f"{final}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _publish(tmp: str, final: str, ext: str):
+    """
+    Atomically move a rendered report into the cache and drop older ones of
+    the same kind that nobody was handed in the last REPORT_KEEP_SECONDS.
+    """
+    os.replace(tmp, final)
+    cutoff = time.time() - REPORT_KEEP_SECONDS
+    for old in glob.glob(os.path.join(os.path.dirname(final), f"*.{ext}")):
+        if old == final:
+            continue
+        try:
+            if os.path.getmtime(old) < cutoff:
+                os.remove(old)
+        except OSError:
+            pass
+
+
+# -------------------------
+# PDF
+# -------------------------
+def pdf_report(candidate_id: str, cursor: str):
+    """
+    Return the path of the PDF report for this cursor, rendering it first if
+    needed. Events are read from the Mongo cursor in batches and drawn as
+    they arrive, but reportlab keeps every page in memory until save()
+    (roughly 150 KB per 1000 rows), so the listing stops after PDF_MAX_ROWS
+    events and points to the CSV report, which streams the whole log.
+    """
+    path = cached_report(candidate_id, cursor, "pdf")
+    if path:
+        return path
+
+    final, tmp = _tmp_path(candidate_id, cursor, "pdf")
+    try:
+        c = canvas.Canvas(tmp, pagesize=letter)
+        c.setFont("Helvetica", 12)
+        c.drawString(40, 750, f"Proctoring Report - Candidate: {candidate_id}")
+        counts, total = summary_counts(candidate_id)
+        c.drawString(40, 735, f"Total events: {total}")
+        y = 720
+        for event_type, n in sorted(counts.items()):
+            c.drawString(60, y, f"{event_type}: {n}")
+            y -= 15
+        y -= 10
+        listed = 0
+        for ev in iter_events(candidate_id):
+            if listed >= PDF_MAX_ROWS:
+                c.drawString(40, y, f"... {total - listed} more events: see the CSV report for the full log")
+                break
+            listed += 1
+            text = f"{_fmt(ev.get('timestamp',''))} | {ev.get('type','')} | {ev.get('details','')}"
+            if ev.get("duration"):
+                text += f" | {ev['duration']:.0f}s"
+            c.drawString(40, y, text[:100])
+            y -= 15
+            if y < 60:
+                c.showPage()
+                c.setFont("Helvetica", 12)
+                y = 750
+        c.save()
+        _publish(tmp, final, "pdf")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return final
+
+
+# -------------------------
+# CSV
+# -------------------------
+def stream_csv(candidate_id: str, cursor: str):
+    """
+    Yield the CSV report in chunks of CSV_CHUNK_ROWS rows straight from the
+    Mongo cursor, teeing it into the cache. The cached copy is only
+    published if the whole report was produced (not on client disconnect).
+    """
+    final, tmp = _tmp_path(candidate_id, cursor, "csv")
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+
+    done = False
+    f = open(tmp, "wb")
+    try:
+        for i, ev in enumerate(iter_events(candidate_id), 1):
+            writer.writerow({k: _fmt(v) for k, v in ev.items()})
+            if i % CSV_CHUNK_ROWS == 0:
+                chunk = buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+                f.write(chunk)
+                yield chunk
+        chunk = buf.getvalue().encode("utf-8")
+        f.write(chunk)
+        yield chunk
+        done = True
+    finally:
+        f.close()
+        if done:
+            _publish(tmp, final, "csv")
+        elif os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from episodes import EpisodeTracker
+
+# -------------------------
+# Config
+# -------------------------
+SESSION_TTL = float(os.getenv("SESSION_TTL", 600))       # seconds without frames before a session is dropped
+SESSION_MAX = int(os.getenv("SESSION_MAX", 10000))       # hard bound on sessions kept per process
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 5))  # seconds between sweeps for idle sessions' episodes
+# Seconds without frames before a session's open episodes are closed. Must
+# exceed the longest gap between frames of a candidate still connected:
+# CAPTURE_INTERVAL_MAX_MS (admission.py, 10 s) and the client's 30 s back-off
+SESSION_IDLE_CLOSE = float(os.getenv("SESSION_IDLE_CLOSE", 45))
+
+
+class SessionState:
+    """Detector state for one candidate (what used to be module globals in detection.py)."""
+
+    __slots__ = ("candidate_id", "lock", "last_seen", "last_face_detected", "focus_away_start", "episodes",
+                 "prev_thumb", "face_count", "orientation", "objects", "frames_since_faces", "frames_since_yolo")
+
+    def __init__(self, candidate_id: str, now: float):
+        self.candidate_id = candidate_id
+        self.lock = threading.Lock()
+        self.last_seen = now
+        self.last_face_detected = now
+        self.focus_away_start = None
+        self.episodes = EpisodeTracker()
+
+        # Last stage results, reused by the detection cascade on static frames
+        self.prev_thumb = None
+        self.face_count = None
+        self.orientation = None
+        self.objects = None
+        self.frames_since_faces = 0
+        self.frames_since_yolo = 0
+
+
+class SessionStore:
+    """
+    Per-candidate SessionState records keyed by candidate_id.
+
+    Records are kept in least-recently-used order: sessions idle for more
+    than `ttl` seconds are evicted on access, and the oldest ones are
+    dropped once more than `max_sessions` are held. Evicted sessions with
+    open episodes are kept aside until `sweep()` closes those episodes, so
+    a candidate who stops sending frames does not leave them "ongoing".
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX,
+                 idle_close: float = SESSION_IDLE_CLOSE):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.idle_close = idle_close
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._retired = []  # evicted states whose episodes sweep() has not closed yet
+        self.evicted = 0
+
+    def get(self, candidate_id: str, now: float = None) -> SessionState:
+        """Return the state for a candidate, creating it on first use."""
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._sessions.get(candidate_id)
+            if state is None:
+                state = SessionState(candidate_id, now)
+                self._sessions[candidate_id] = state
+            else:
+                self._sessions.move_to_end(candidate_id)
+            state.last_seen = now
+            self._evict(now)
+        return state
+
+    def drop(self, candidate_id: str):
+        """Forget a session; returns its state (or None)."""
+        with self._lock:
+            return self._sessions.pop(candidate_id, None)
+
+    def _evict(self, now: float):
+        sessions = self._sessions
+        while sessions:
+            oldest = next(iter(sessions.values()))
+            if now - oldest.last_seen <= self.ttl and len(sessions) <= self.max_sessions:
+                break
+            _, state = sessions.popitem(last=False)
+            if state.episodes.open:
+                self._retired.append(state)
+            self.evicted += 1
+
+    def sweep(self, now: float = None):
+        """
+        Close the episodes of evicted sessions and of sessions without frames
+        for `idle_close` seconds. Conditions that end while frames keep coming
+        are closed by the per-frame EpisodeTracker.sweep() instead: between
+        frames a slowed-down client is not gone, and closing its episodes
+        would split one condition into an episode per frame.
+        Returns [(candidate_id, records)].
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict(now)
+            retired, self._retired = self._retired, []
+            idle = [state for state in self._sessions.values()
+                    if state.episodes.open and now - state.last_seen > self.idle_close]
+        closed = []
+        for state in retired + idle:
+            with state.lock:
+                records = state.episodes.close_all()
+            if records:
+                closed.append((state.candidate_id, records))
+        return closed
+
+    def close_all(self):
+        """Forget every session, closing their open episodes (shutdown). Returns [(candidate_id, records)]."""
+        with self._lock:
+            states = self._retired + list(self._sessions.values())
+            self._sessions.clear()
+            self._retired = []
+        closed = []
+        for state in states:
+            with state.lock:
+                records = state.episodes.close_all()
+            if records:
+                closed.append((state.candidate_id, records))
+        return closed
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "evicted": self.evicted,
+                "ttl": self.ttl, "max_sessions": self.max_sessions,
+                "idle_close": self.idle_close}
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+
+# -------------------------
+# Config
+# -------------------------
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "videos")
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1 << 20))       # bytes held in memory per write
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 4 << 30))         # per recording
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_locks = {}  # upload_id -> [lock, holders and waiters]; appends and finalize of one upload never interleave
+
+
+class UploadError(Exception):
+    """Raised for an invalid upload request; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, message: str, **extra):
+        super().__init__(message)
+        self.status_code = status_code
+        self.extra = extra
+
+
+def safe_filename(filename: str, default: str):
+    """
+    Base name of `filename` (or of `default` when it is empty) with anything
+    but letters, digits, "_", "." and "-" replaced, so a client cannot write
+    outside UPLOAD_DIR. Both are cleaned: the default usually embeds a
+    client-supplied candidate id.
+    """
+    for name in (filename, default):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename((name or "").replace("\\", "/")).strip())
+        if name.strip("."):  # "", "." and ".." name no file
+            return name
+    raise UploadError(400, "Invalid file name")
+
+
+def upload_path(filename: str):
+    """Where an uploaded file goes: `filename` (from safe_filename) inside UPLOAD_DIR, checked once more."""
+    root = os.path.realpath(UPLOAD_DIR)
+    path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.dirname(os.path.realpath(path)) != root:
+        raise UploadError(400, "Invalid file name")
+    return path
+
+
+@asynccontextmanager
+async def _upload_lock(upload_id: str):
+    """Per-upload lock, forgotten once nobody holds or waits for it (so unknown or abandoned ids leave nothing behind)."""
+    entry = _locks.setdefault(upload_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _locks.pop(upload_id, None)
+
+
+async def save_stream(chunks, path: str):
+    """Write an async iterator of byte chunks to `path`; returns bytes written."""
+    written = 0
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            written += len(chunk)
+            await run_in_threadpool(f.write, chunk)
+    return written
+
+
+async def iter_upload_file(file):
+    """Read an UploadFile UPLOAD_CHUNK_SIZE bytes at a time."""
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+# -------------------------
+# Resumable uploads: init -> append chunk at offset -> finalize
+# -------------------------
+def _paths(upload_id: str):
+    if not _UPLOAD_ID.match(upload_id or ""):
+        raise UploadError(404, "Upload not found")
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part"), os.path.join(PARTIAL_DIR, f"{upload_id}.json")
+
+
+def init_upload(candidate_id: str, filename: str = None, size: int = None):
+    """Start a resumable upload; returns its metadata (upload_id, offset 0)."""
+    if size is not None and size > UPLOAD_MAX_BYTES:
+        raise UploadError(413, "Upload too large", max_bytes=UPLOAD_MAX_BYTES)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    data_path, meta_path = _paths(upload_id)
+    meta = {
+        "upload_id": upload_id,
+        "candidate_id": candidate_id,
+        "filename": safe_filename(filename, f"{candidate_id}_video.webm"),
+        "size": size,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    open(data_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return {**meta, "offset": 0, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+
+def get_upload(upload_id: str):
+    """Metadata plus the current offset (bytes safely on disk), which is where the client resumes."""
+    data_path, meta_path = _paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise UploadError(404, "Upload not found")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return {**meta, "offset": os.path.getsize(data_path)}
+
+
+async def append_chunk(upload_id: str, offset: int, chunks, sha256: str = None):
+    """
+    Append a streamed chunk at `offset`, which must equal the bytes already
+    received (409 otherwise, with the offset to resume from). With `sha256`
+    the chunk is verified and rolled back on mismatch. Returns the new offset.
+    """
+    data_path, _ = _paths(upload_id)
+    async with _upload_lock(upload_id):
+        current = get_upload(upload_id)["offset"]
+        if offset != current:
+            raise UploadError(409, "Offset mismatch", offset=current)
+
+        digest = hashlib.sha256()
+        written = 0
+        ok = False
+        try:
+            with open(data_path, "ab") as f:
+                async for chunk in chunks:
+                    written += len(chunk)
+                    if offset + written > UPLOAD_MAX_BYTES:
+                        raise UploadError(413, "Upload too large", max_bytes=UPLOAD_MAX_BYTES)
+                    digest.update(chunk)
+                    await run_in_threadpool(f.write, chunk)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise UploadError(400, "Chunk checksum mismatch", offset=offset)
+            ok = True
+        finally:
+            if not ok:
+                # Drop the partial chunk so the client can resend it from `offset`
+                os.truncate(data_path, offset)
+        return offset + written
+
+
+def _file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def finalize_upload(upload_id: str, size: int = None, sha256: str = None):
+    """
+    Check the total size and (optionally) the whole-file SHA-256, then move
+    the file into UPLOAD_DIR. Returns (metadata, final path, sha256). Holds
+    the upload's lock, so a chunk still being appended is not cut off.
+    """
+    _paths(upload_id)
+    async with _upload_lock(upload_id):
+        return await run_in_threadpool(_finalize, upload_id, size, sha256)
+
+
+def _finalize(upload_id: str, size: int, sha256: str):
+    data_path, meta_path = _paths(upload_id)
+    meta = get_upload(upload_id)
+    expected = size if size is not None else meta.get("size")
+    if expected is not None and meta["offset"] != expected:
+        raise UploadError(409, "Upload incomplete", offset=meta["offset"], size=expected)
+    digest = _file_sha256(data_path)
+    if sha256 and digest != sha256.lower():
+        raise UploadError(400, "Checksum mismatch", sha256=digest)
+
+    final_path = upload_path(safe_filename(meta["filename"], f"{meta['candidate_id']}_video.webm"))
+    os.replace(data_path, final_path)
+    os.remove(meta_path)
+    return meta, final_path, digest
@@ -0,0 +1,281 @@
+# video_analysis.py
+import os
+import sys
+import math
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+import subprocess
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import cv2
+import db
+from event_writer import coalesce
+
+# -------------------------
+# Config
+# -------------------------
+POSTHOC_SAMPLE_FPS = float(os.getenv("POSTHOC_SAMPLE_FPS", 2))          # frames analyzed per second of video
+POSTHOC_CHUNK_SECONDS = float(os.getenv("POSTHOC_CHUNK_SECONDS", 60))   # video time per parallel chunk
+POSTHOC_WORKERS = int(os.getenv("POSTHOC_WORKERS", os.cpu_count() or 1))
+POSTHOC_BATCH = int(os.getenv("POSTHOC_BATCH", 8))                      # sampled frames per YOLO batch
+POSTHOC_NICE = int(os.getenv("POSTHOC_NICE", 10))                       # CPU priority increment for analysis jobs
+POSTHOC_MAX_JOBS = int(os.getenv("POSTHOC_MAX_JOBS", 1))                # jobs started by the API that run at once (each uses POSTHOC_WORKERS processes)
+FFPROBE_TIMEOUT = 300                                                   # seconds for ffprobe to list a video's packets
+
+# -------------------------
+# Job planning
+# -------------------------
+def probe_duration(path: str):
+    """
+    Video duration in seconds and where it came from: "container" (header),
+    "ffprobe" (timestamp of the last video packet) or "decode" (read to the
+    end). MediaRecorder webm files have no duration in the header, hence the
+    fallbacks. (None, None) when not a single frame can be read.
+    """
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    if fps > 0 and frames > 0:
+        return frames / fps, "container"
+    duration = _ffprobe_duration(path)
+    if duration:
+        return duration, "ffprobe"
+    duration = _decoded_duration(path)
+    if duration is not None:
+        return duration, "decode"
+    return None, None
+
+def _ffprobe_duration(path: str):
+    """Last video packet timestamp (demuxing only, no decoding), or None without ffprobe."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    cmd = [ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time", "-of", "csv=p=0", path]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=FFPROBE_TIMEOUT).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    times = []
+    for line in out.split():
+        try:
+            times.append(float(line.strip(",")))
+        except ValueError:  # N/A
+            continue
+    return max(times) if times else None
+
+def _decoded_duration(path: str):
+    """Timestamp of the last frame, found by reading the whole video (slow, last resort)."""
+    cap = cv2.VideoCapture(path)
+    last = None
+    while cap.grab():
+        last = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+    cap.release()
+    return last
+
+def job_id_for(path: str, candidate_id: str, sample_fps: float, chunk_seconds: float):
+    """Same file + same settings -> same job, which is what makes a re-run resume instead of restart."""
+    st = os.stat(path)
+    key = f"{candidate_id}|{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}|{sample_fps}|{chunk_seconds}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:24]
+
+def plan_chunks(duration: float, chunk_seconds: float):
+    n = max(1, math.ceil(duration / chunk_seconds))
+    return [{"index": i, "start": i * chunk_seconds, "end": min((i + 1) * chunk_seconds, duration),
+             "status": "pending"} for i in range(n)]
+
+# -------------------------
+# Worker side
+# -------------------------
+def _init_worker():
+    import detection
+    detection.load_models()  # once per process, before the first chunk
+
+def analyze_chunk(path: str, job_id: str, chunk: dict, sample_fps: float, batch_size: int, base_time: float):
+    """
+    Decode one time range of the video, sample it at `sample_fps` and run
+    the detectors in batches. Frames that are not sampled are only grabbed,
+    never converted. Returns (frames analyzed, episode records).
+    """
+    from detection import analyze_batch, sessions
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Unable to open video {path}")
+    start, end = chunk["start"], chunk["end"]
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000.0)
+
+    # Detector state is per chunk; its clock is the recording's wall time
+    key = f"posthoc:{job_id}:{chunk['index']}"
+    step = 1.0 / sample_fps
+    next_t = start
+    frames, times, records = [], [], []
+    analyzed = 0
+    while cap.grab():
+        t = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if end is not None and t >= end:
+            break
+        if t < next_t:
+            continue
+        ok, frame = cap.retrieve()
+        if not ok:
+            break
+        next_t = max(next_t + step, t)
+        frames.append(frame)
+        times.append(base_time + t)
+        if len(frames) >= batch_size:
+            records += analyze_batch(frames, key, times)
+            analyzed += len(frames)
+            frames, times = [], []
+    if frames:
+        records += analyze_batch(frames, key, times)
+        analyzed += len(frames)
+    cap.release()
+
+    state = sessions.drop(key)
+    if state is not None:
+        records += state.episodes.close_all()
+    return analyzed, records
+
+# -------------------------
+# Job runner
+# -------------------------
+def run_job(path: str, candidate_id: str, sample_fps: float = POSTHOC_SAMPLE_FPS,
+            chunk_seconds: float = POSTHOC_CHUNK_SECONDS, workers: int = POSTHOC_WORKERS,
+            batch_size: int = POSTHOC_BATCH):
+    """
+    Analyze a recorded video in parallel chunks and store the events in
+    `detections`, tagged source="posthoc". Progress is kept per chunk in the
+    video_jobs collection; running the same job again only processes the
+    chunks that are not done yet.
+    """
+    path = os.path.abspath(path)
+    job_id = job_id_for(path, candidate_id, sample_fps, chunk_seconds)
+    duration, duration_source = probe_duration(path)
+    if duration is None:
+        # Without a length neither the chunks nor the recording's start time can be placed
+        error = "no frame could be read to determine the video length"
+        job = db.create_video_job({"_id": job_id, "candidate_id": candidate_id, "path": path, "chunks": [],
+                                   "status": "failed", "error": error, "created_at": datetime.utcnow()})
+        if job["status"] != "done":
+            db.update_video_job(job_id, {"status": "failed", "error": error})
+        print(f"[{job_id}] {path}: {error}")
+        return job_id
+    job = db.create_video_job({
+        "_id": job_id,
+        "candidate_id": candidate_id,
+        "path": path,
+        "duration": duration,
+        "duration_source": duration_source,
+        "sample_fps": sample_fps,
+        "chunk_seconds": chunk_seconds,
+        # Recording start, estimated from when the file was last written
+        "base_time": os.path.getmtime(path) - (duration or 0),
+        "chunks": plan_chunks(duration, chunk_seconds),
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+    })
+    chunks = job["chunks"]
+    pending = [c for c in chunks if c["status"] != "done"]
+    if not pending:
+        print(f"[{job_id}] already complete")
+        return job_id
+
+    total, done, failed = len(chunks), len(chunks) - len(pending), 0
+    base_dt = datetime.utcfromtimestamp(job["base_time"])
+    db.update_video_job(job_id, {"status": "running", "progress": done / total})
+    print(f"[{job_id}] analyzing {path}: {len(pending)}/{total} chunks to go")
+
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending))), mp_context=ctx,
+                             initializer=_init_worker) as pool:
+        futures = {pool.submit(analyze_chunk, path, job_id, c, sample_fps, batch_size, job["base_time"]): c
+                   for c in pending}
+        for fut in as_completed(futures):
+            i = futures[fut]["index"]
+            try:
+                analyzed, records = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{job_id}] chunk {i} failed: {e!r}")
+                db.update_video_job(job_id, {f"chunks.{i}.status": "failed", f"chunks.{i}.error": repr(e)})
+                continue
+
+            docs = coalesce([db.make_event_doc(candidate_id, {
+                **rec,
+                "source": "posthoc",
+                "job_id": job_id,
+                "chunk": i,
+                "video_time": (rec["timestamp"] - base_dt).total_seconds(),
+            }) for rec in records])
+            db.replace_chunk_events(job_id, i, docs)
+
+            done += 1
+            counts = Counter(doc["type"] for doc in docs)
+            db.update_video_job(job_id, {
+                f"chunks.{i}.status": "done",
+                f"chunks.{i}.frames": analyzed,
+                f"chunks.{i}.counts": dict(counts),
+                "progress": done / total,
+            })
+            print(f"[{job_id}] chunk {i} done: {analyzed} frames, {len(docs)} episodes ({done}/{total})")
+
+    db.update_video_job(job_id, {"status": "failed" if failed else "done"})
+    return job_id
+
+def start_job_process(path: str, candidate_id: str):
+    """Run a job in a separate, lower-priority process."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, os.path.join(here, "video_analysis.py"), os.path.abspath(path),
+                             "--candidate-id", candidate_id], cwd=here, start_new_session=True)
+
+# Jobs from /upload_video wait here, so that at most POSTHOC_MAX_JOBS job
+# processes (each with POSTHOC_WORKERS workers) run at a time
+_job_queue = queue.Queue()
+_job_runners = []
+_job_runners_lock = threading.Lock()
+
+def queue_job(path: str, candidate_id: str):
+    """Queue a job process (used by /upload_video); returns the number of jobs waiting ahead of it."""
+    with _job_runners_lock:
+        if not _job_runners:
+            for i in range(max(1, POSTHOC_MAX_JOBS)):
+                t = threading.Thread(target=_run_queued_jobs, name=f"posthoc-jobs-{i}", daemon=True)
+                t.start()
+                _job_runners.append(t)
+    ahead = _job_queue.qsize()
+    _job_queue.put((path, candidate_id))
+    return ahead
+
+def _run_queued_jobs():
+    while True:
+        path, candidate_id = _job_queue.get()
+        try:
+            start_job_process(path, candidate_id).wait()
+        except OSError as e:
+            print(f"[posthoc] could not start job for {path}: {e!r}")
+
+# -------------------------
+# CLI
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze a recorded interview video (post-hoc)")
+    parser.add_argument("path", help="Video file, e.g. videos/candidate_1_video.webm")
+    parser.add_argument("--candidate-id", type=str, required=True, help="Candidate/session id to tag events")
+    parser.add_argument("--fps", type=float, default=POSTHOC_SAMPLE_FPS, help="Frames analyzed per second of video")
+    parser.add_argument("--chunk-seconds", type=float, default=POSTHOC_CHUNK_SECONDS, help="Video seconds per parallel chunk")
+    parser.add_argument("--workers", type=int, default=POSTHOC_WORKERS, help="Worker processes")
+    parser.add_argument("--batch", type=int, default=POSTHOC_BATCH, help="Sampled frames per YOLO batch")
+    parser.add_argument("--nice", type=int, default=POSTHOC_NICE, help="CPU priority increment (inherited by workers)")
+    args = parser.parse_args()
+
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)
+    run_job(args.path, args.candidate_id, sample_fps=args.fps, chunk_seconds=args.chunk_seconds,
+            workers=args.workers, batch_size=args.batch)
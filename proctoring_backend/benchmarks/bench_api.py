@@ -0,0 +1,138 @@
+"""
+End-to-end /analyze/raw throughput and latency with N concurrent simulated
+candidates. The API runs in this process (uvicorn in a thread) against a
+Mongo stand-in unless --mongo-uri is given; inference uses the pool as
+configured by the INFERENCE_* environment variables.
+
+    python bench_api.py --candidates 1,4,16 --duration 20
+    INFERENCE_WORKERS=4 INFERENCE_THREADS=2 YOLO_MAX_BATCH=4 python bench_api.py --candidates 16
+"""
+import os
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from collections import Counter
+
+from common import RESOLUTIONS, summarize, synthetic_frame, recorded_frames, encode_jpeg, use_mongo, write_results, print_table
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int):
+    """Run app.app with uvicorn in a daemon thread; returns the server once it accepts requests."""
+    import uvicorn
+    from app import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    deadline = time.time() + 300  # model loading happens on startup
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("server did not start")
+        time.sleep(0.1)
+    return server
+
+
+async def candidate(client, candidate_id: str, payloads, fps: float, stop_at: float, latencies, statuses):
+    """One simulated candidate: sends frames back to back, or paced at `fps` like the browser."""
+    i = 0
+    interval = 1.0 / fps if fps else 0.0
+    while time.perf_counter() < stop_at:
+        t0 = time.perf_counter()
+        try:
+            r = await client.post("/analyze/raw", params={"candidate_id": candidate_id},
+                                  content=payloads[i % len(payloads)], headers={"Content-Type": "image/jpeg"})
+            statuses[r.status_code] += 1
+            if r.status_code == 200:
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+        i += 1
+        if interval:
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+
+
+async def run_level(base_url: str, n: int, payloads, duration: float, fps: float, warmup: float):
+    import httpx
+
+    limits = httpx.Limits(max_connections=n, max_keepalive_connections=n)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        if warmup:
+            stop_at = time.perf_counter() + warmup
+            await asyncio.gather(*(candidate(client, f"bench-warmup-{i}", payloads, fps, stop_at, [], Counter())
+                                   for i in range(n)))
+        latencies, statuses = [], Counter()
+        started = time.perf_counter()
+        stop_at = started + duration
+        await asyncio.gather(*(candidate(client, f"bench-{n}-{i}", payloads, fps, stop_at, latencies, statuses)
+                               for i in range(n)))
+        elapsed = time.perf_counter() - started
+        stats = (await client.get("/inference/stats")).json()
+    return {
+        **summarize(latencies),
+        "throughput_fps": round(len(latencies) / elapsed, 2),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "inference_stats": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /analyze/raw end to end")
+    parser.add_argument("--candidates", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds measured per level")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each level")
+    parser.add_argument("--fps", type=float, default=0, help="Frames/s per candidate (0 = back to back)")
+    parser.add_argument("--resolution", default="640x480", help="Frame size sent by each candidate")
+    parser.add_argument("--video", help="Send frames sampled from this recording instead of synthetic ones")
+    parser.add_argument("--mongo-uri", help="Real MongoDB to write events to (default: in-memory stand-in)")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--out", help="Results file (default: results/api-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    w, h = RESOLUTIONS.get(args.resolution) or tuple(map(int, args.resolution.lower().split("x")))
+    frames = recorded_frames(args.video) if args.video else [synthetic_frame(w, h, seed) for seed in range(4)]
+    if not frames:
+        parser.error("no frames could be read from --video")
+    import cv2
+    payloads = [encode_jpeg(cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA)) for f in frames]
+
+    server = None
+    mongo = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        mongo = use_mongo(args.mongo_uri)
+        port = _free_port()
+        server = start_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    results = {}
+    try:
+        for n in map(int, args.candidates.split(",")):
+            print(f"[api] {n} candidates for {args.duration:.0f}s")
+            results[f"analyze_raw/{w}x{h}/c{n}"] = asyncio.run(
+                run_level(base_url, n, payloads, args.duration, args.fps, args.warmup))
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+    print_table(results)
+    write_results("api", results, {
+        "duration": args.duration,
+        "fps": args.fps,
+        "resolution": f"{w}x{h}",
+        "video": args.video,
+        "mongo": mongo or args.url,
+        "env": {k: v for k, v in os.environ.items()
+                if k.startswith(("INFERENCE_", "YOLO_", "CASCADE_", "EVENT_", "OMP_"))},
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Read-path timings for one candidate's log at 10k-1M events: the async_db
+queries the API serves (get_events for /logs, get_events_since,
+get_log_cursor, get_summary), a full iter_events scan, and /report
+rendering (PDF cold and cached, CSV streamed).
+
+The default in-memory stand-in is fine for 10k-100k events; use a real
+server for 1M (`--mongo-uri mongodb://localhost:27017/`). Benchmark events
+are written under "bench-db-<size>" candidate ids and removed afterwards.
+
+    python bench_db.py --sizes 10000,100000
+    python bench_db.py --sizes 10000,100000,1000000 --mongo-uri mongodb://localhost:27017/
+"""
+import time
+import asyncio
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from common import summarize, timed, use_mongo, write_results, print_table
+
+EVENT_TYPES = ["NO_FACE", "MULTIPLE_FACES", "FOCUS_LOST", "OBJECT_DETECTED"]
+SEED_BATCH = 10000
+
+
+def seed(candidate_id: str, size: int):
+    """Insert `size` closed-episode events spread over a long interview, plus their summary."""
+    import db
+
+    db.init_db()
+    start = datetime.utcnow() - timedelta(seconds=size)
+    # Already past the log settle window, so get_log_cursor() sees the seeded events
+    updated_at = db.settled_before() - timedelta(seconds=1)
+    written = 0
+    while written < size:
+        docs = []
+        for i in range(written, min(size, written + SEED_BATCH)):
+            ts = start + timedelta(seconds=i)
+            event_type = EVENT_TYPES[i % len(EVENT_TYPES)]
+            doc = db.make_event_doc(candidate_id, {
+                "type": event_type,
+                "details": f"{event_type.lower()} benchmark event {i}",
+                "status": "open",
+                "timestamp": ts,
+                "end": ts + timedelta(seconds=3),
+                "duration": 3.0,
+                "frames": 6,
+                "peak_confidence": 0.8 if event_type == "OBJECT_DETECTED" else None,
+            })
+            doc["updated_at"] = updated_at
+            docs.append(doc)
+        db.detections_collection.insert_many(docs, ordered=False)
+        db.update_summaries(db.summary_increments(docs))
+        written += len(docs)
+
+
+def cleanup(candidate_id: str):
+    import db
+
+    db.detections_collection.delete_many({"candidate_id": candidate_id})
+    db.summaries_collection.delete_one({"_id": candidate_id})
+
+
+def bench_size(loop, candidate_id: str, repeat: int, report_repeat: int):
+    import db
+    import async_db
+    import reports
+
+    samples = {}
+
+    def run(name, n, fn, *args, **kwargs):
+        samples[name] = [timed(fn, *args, **kwargs)[1] for _ in range(n)]
+
+    def run_async(name, n, fn, *args):
+        run(name, n, lambda: loop.run_until_complete(fn(*args)))
+
+    run_async("get_events/limit=100", repeat, async_db.get_events, candidate_id, 100)
+    run_async("get_events/limit=1000", repeat, async_db.get_events, candidate_id, 1000)
+    run_async("get_events_since/first_page", repeat, async_db.get_events_since, candidate_id, db.ZERO_CURSOR, 1000)
+    cursor = loop.run_until_complete(async_db.get_log_cursor(candidate_id))
+    if cursor is None:
+        raise SystemExit(f"no settled log cursor for {candidate_id}: the seeded events were not found")
+    run_async("get_events_since/caught_up", repeat, async_db.get_events_since, candidate_id, cursor, 1000)
+    run_async("get_log_cursor", repeat, async_db.get_log_cursor, candidate_id)
+    run_async("get_summary", repeat, async_db.get_summary, candidate_id)
+    run("iter_events/full_scan", report_repeat, lambda: sum(1 for _ in db.iter_events(candidate_id)))
+
+    cold = []
+    for _ in range(report_repeat):
+        shutil.rmtree(reports._candidate_dir(candidate_id), ignore_errors=True)
+        cold.append(timed(reports.pdf_report, candidate_id, cursor)[1])
+    samples["report_pdf/cold"] = cold
+    run("report_pdf/cached", repeat, reports.pdf_report, candidate_id, cursor)
+    run("report_csv/stream", report_repeat, lambda: sum(len(chunk) for chunk in reports.stream_csv(candidate_id, cursor)))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event log reads and report rendering")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated event counts")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs of each cheap query")
+    parser.add_argument("--report-repeat", type=int, default=3, help="Runs of full scans and cold reports")
+    parser.add_argument("--mongo-uri", help="Real MongoDB (default: in-memory stand-in)")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded events")
+    parser.add_argument("--out", help="Results file (default: results/db-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    mongo = use_mongo(args.mongo_uri)
+    import async_db
+    import reports
+
+    loop = asyncio.new_event_loop()
+    report_dir = tempfile.mkdtemp(prefix="bench-reports-")
+    reports.REPORT_CACHE_DIR = report_dir
+    results = {}
+    try:
+        for size in map(int, args.sizes.split(",")):
+            candidate_id = f"bench-db-{size}"
+            cleanup(candidate_id)
+            t0 = time.perf_counter()
+            seed(candidate_id, size)
+            print(f"[db] seeded {size} events in {time.perf_counter() - t0:.1f}s")
+            try:
+                for name, ms in bench_size(loop, candidate_id, args.repeat, args.report_repeat).items():
+                    results[f"{size}/{name}"] = summarize(ms)
+            finally:
+                if not args.keep:
+                    cleanup(candidate_id)
+    finally:
+        shutil.rmtree(report_dir, ignore_errors=True)
+        loop.run_until_complete(async_db.close())
+        loop.close()
+
+    print_table(results)
+    write_results("db", results, {"repeat": args.repeat, "report_repeat": args.report_repeat, "mongo": mongo}, args.out)
+
+
+if __name__ == "__main__":
+    main()
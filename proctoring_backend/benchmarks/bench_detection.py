@@ -0,0 +1,97 @@
+"""
+Per-stage latency of the detection hot path (detection.analyze_frame):
+JPEG decode, shared preprocessing (resize pyramid + RGB conversion, see
+detection.FramePrep), face detection, FaceMesh on the face crop (with
+HEAD_POSE_SOURCE=mesh), YOLO, and the whole analyze_frame call, on
+synthetic and recorded frames at several resolutions.
+
+    python bench_detection.py --iterations 50
+    python bench_detection.py --video ../app/videos/candidate_1_video.webm --resolutions 640x480
+"""
+import os
+import argparse
+from collections import defaultdict
+
+from common import (RESOLUTIONS, summarize, timed, synthetic_frame, recorded_frames, encode_jpeg,
+                    write_results, print_table)
+
+
+def bench_frames(frames, iterations: int, warmup: int, candidate_id: str):
+    """Time every stage on each of `frames` in turn, `iterations` times in total."""
+    import detection
+    from inference_pool import decode_frame
+
+    detection.load_models()
+    payloads = [encode_jpeg(f) for f in frames]
+    samples = defaultdict(list)
+    for i in range(warmup + iterations):
+        frame, payload = frames[i % len(frames)], payloads[i % len(frames)]
+        timings = {}
+        decoded, timings["decode"] = timed(decode_frame, payload)
+        prep = detection.FramePrep(decoded)
+        (yolo_input, rgb), timings["preprocess"] = timed(
+            lambda: (prep.scaled(detection.detector.imgsz), prep.rgb(detection.FACE_INPUT_SIZE)))
+        with detection.face_lock:
+            faces, timings["face"] = timed(detection.mp_face_detection.process, rgb)
+        if detection.mp_face_mesh is not None and faces.detections:
+            crop, _ = prep.face_crop(faces.detections[0].location_data.relative_bounding_box,
+                                     detection.FACE_ROI_MARGIN)
+            if crop is not None:
+                with detection.face_lock:
+                    _, timings["mesh"] = timed(detection.mp_face_mesh.process, crop)
+        _, timings["yolo"] = timed(detection.detector, [yolo_input])
+        _, timings["analyze_frame"] = timed(detection.analyze_frame, frame, candidate_id)
+        if i >= warmup:
+            for stage, ms in timings.items():
+                samples[stage].append(ms)
+    detection.sessions.drop(candidate_id)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-frame detection stages")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS), help="Comma-separated WxH list")
+    parser.add_argument("--iterations", type=int, default=30, help="Timed frames per resolution and source")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed frames first (model warm-up)")
+    parser.add_argument("--video", help="Recorded video to sample frames from")
+    parser.add_argument("--images", help="Glob of recorded frames, e.g. 'frames/*.jpg'")
+    parser.add_argument("--out", help="Results file (default: results/detection-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    import cv2
+    import detection
+
+    sources = {"synthetic": [synthetic_frame(1280, 720, seed) for seed in range(4)]}
+    if args.video or args.images:
+        frames = recorded_frames(args.video, args.images)
+        if not frames:
+            parser.error("no frames could be read from --video/--images")
+        sources["recorded"] = frames
+
+    results = {}
+    for res in args.resolutions.split(","):
+        w, h = RESOLUTIONS.get(res) or tuple(map(int, res.lower().split("x")))
+        for source, frames in sources.items():
+            scaled = [cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA) for f in frames]
+            print(f"[detection] {source} {w}x{h}: {args.iterations} frames")
+            samples = bench_frames(scaled, args.iterations, args.warmup, f"bench:{source}:{w}x{h}")
+            for stage, ms in samples.items():
+                results[f"{w}x{h}/{source}/{stage}"] = summarize(ms)
+
+    print_table(results)
+    write_results("detection", results, {
+        "iterations": args.iterations,
+        "warmup": args.warmup,
+        "video": args.video,
+        "images": args.images,
+        "cascade_enabled": detection.CASCADE_ENABLED,
+        "face_input_size": detection.FACE_INPUT_SIZE,
+        "head_pose_source": detection.HEAD_POSE_SOURCE,
+        "yolo_max_batch": detection.YOLO_MAX_BATCH,
+        "detector": detection.detector.describe(),
+        "omp_num_threads": os.getenv("OMP_NUM_THREADS"),
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
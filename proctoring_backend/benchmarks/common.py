@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(HERE), "app")
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# The app modules import each other by bare name (run from app/)
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+RESOLUTIONS = {"320x240": (320, 240), "640x480": (640, 480), "1280x720": (1280, 720)}
+
+
+# -------------------------
+# Timing
+# -------------------------
+def summarize(samples_ms):
+    """Latency summary of a list of samples in milliseconds."""
+    if not samples_ms:
+        return {"n": 0}
+    a = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p90_ms": round(float(np.percentile(a, 90)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "min_ms": round(float(a.min()), 3),
+        "max_ms": round(float(a.max()), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return (result, elapsed milliseconds)."""
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - t0) * 1000.0
+
+
+# -------------------------
+# Frames
+# -------------------------
+def synthetic_frame(width: int, height: int, seed: int = 0):
+    """Deterministic BGR test frame: a gradient background with a face-sized blob and some noise."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    frame = frame.astype(np.uint8)
+    cv2.ellipse(frame, (width // 2, height // 2), (width // 8, height // 5), 0, 0, 360, (150, 180, 220), -1)
+    noise = rng.integers(0, 16, size=frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def recorded_frames(video: str = None, images: str = None, limit: int = 50):
+    """Frames from a recorded video (evenly sampled) or an image glob."""
+    import cv2
+    import glob
+
+    frames = []
+    if images:
+        for path in sorted(glob.glob(images))[:limit]:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is not None:
+                frames.append(img)
+    if video:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+        step = max(1, total // limit) if total else 1
+        i = 0
+        while len(frames) < limit and cap.grab():
+            if i % step == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    frames.append(frame)
+            i += 1
+        cap.release()
+    return frames
+
+
+def encode_jpeg(frame, quality: int = 80):
+    import cv2
+
+    ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise RuntimeError("JPEG encode failed")
+    return buf.tobytes()
+
+
+# -------------------------
+# Mongo
+# -------------------------
+def use_mongo(uri: str = None):
+    """
+    Point db.py and async_db.py at a real Mongo (`uri`) or at an in-memory
+    mongomock stand-in (one store shared by the sync and async clients).
+    Must be called before anything imports `db`. mongomock does not support
+    collection validators, so those are ignored by the stand-in.
+    """
+    if "db" in sys.modules:
+        raise RuntimeError("use_mongo() must run before db is imported")
+    if uri:
+        os.environ["MONGO_URI"] = uri
+        return "mongodb"
+
+    import pymongo
+    import mongomock
+    from mongomock.store import ServerStore
+    from mongomock_motor import AsyncMongoMockClient
+    from mongomock.database import Database
+    from mongomock.collection import Collection
+
+    create_collection, command = Database.create_collection, Database.command
+
+    def _create_collection(self, name, **kwargs):
+        kwargs.pop("validator", None)
+        return create_collection(self, name, **kwargs)
+
+    def _command(self, cmd, *args, **kwargs):
+        if isinstance(cmd, dict) and "collMod" in cmd:
+            return {"ok": 1.0}
+        return command(self, cmd, *args, **kwargs)
+
+    def _bulk_write(self, requests, ordered=True, **kwargs):
+        # mongomock's bulk_write does not accept the arguments newer pymongo
+        # operations pass, so the stand-in applies them one by one
+        inserted = modified = 0
+        for op in requests:
+            if isinstance(op, pymongo.InsertOne):
+                self.insert_one(op._doc)
+                inserted += 1
+            elif isinstance(op, pymongo.UpdateOne):
+                modified += self.update_one(op._filter, op._doc, upsert=op._upsert).modified_count
+            elif isinstance(op, pymongo.DeleteMany):
+                self.delete_many(op._filter)
+            else:
+                raise NotImplementedError(f"stand-in bulk_write does not support {type(op).__name__}")
+        return SimpleNamespace(inserted_count=inserted, modified_count=modified)
+
+    Database.create_collection = _create_collection
+    Database.command = _command
+    Collection.bulk_write = _bulk_write
+    store = ServerStore()
+
+    def _client(*args, **kwargs):
+        return mongomock.MongoClient(*args, _store=store, **kwargs)
+
+    class _AsyncClient(AsyncMongoMockClient):
+        def __init__(self, *args, **kwargs):
+            super().__init__(mock_mongo_client=_client(*args, **kwargs))
+
+        async def close(self):  # awaitable, as on pymongo's AsyncMongoClient
+            pass
+
+    pymongo.MongoClient = _client
+    pymongo.AsyncMongoClient = _AsyncClient
+    return "mongomock"
+
+
+# -------------------------
+# Results
+# -------------------------
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.check_output(["git", *args], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {"commit": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def machine_info():
+    info = {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    for name in ("numpy", "cv2", "mediapipe", "ultralytics", "torch", "pymongo"):
+        module = sys.modules.get(name)
+        if module is not None:
+            info[f"{name}_version"] = getattr(module, "__version__", None)
+    return info
+
+
+def write_results(benchmark: str, results: dict, config: dict, out: str = None):
+    """Write a results file (see compare.py) and return its path."""
+    doc = {
+        "benchmark": benchmark,
+        "created_at": datetime.utcnow().isoformat(),
+        "git": git_info(),
+        "machine": machine_info(),
+        "config": config,
+        "results": results,
+    }
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = (doc["git"]["commit"] or "nogit")[:10]
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"{benchmark}-{commit}-{stamp}.json")
+    with open(out, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+    print(f"[{benchmark}] results written to {out}")
+    return out
+
+
+def print_table(results: dict):
+    for key, stats in sorted(results.items()):
+        if "p50_ms" not in stats:
+            print(f"{key:<48} no samples")
+            continue
+        line = f"{key:<48} n={stats['n']:<6} p50={stats['p50_ms']:>9.2f}ms  p99={stats['p99_ms']:>9.2f}ms"
+        if "throughput_fps" in stats:
+            line += f"  {stats['throughput_fps']:.1f} frames/s"
+        print(line)
@@ -0,0 +1,72 @@
+"""
+Compare two benchmark results files, e.g. before and after a change to
+detection.py. Prints p50/p99 (and throughput) side by side and exits with
+status 1 when anything got slower than --threshold percent.
+
+    python compare.py results/detection-<old>.json results/detection-<new>.json --threshold 10
+"""
+import sys
+import json
+import argparse
+
+# metric -> True when higher is better
+METRICS = {"p50_ms": False, "p99_ms": False, "throughput_fps": True}
+
+
+def load(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(old, new, higher_is_better: bool):
+    """Relative change in percent, positive = regression."""
+    if not old:
+        return 0.0
+    pct = (new - old) / old * 100.0
+    return -pct if higher_is_better else pct
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files")
+    parser.add_argument("base", help="Results file of the baseline commit")
+    parser.add_argument("new", help="Results file to compare against the baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    if base["benchmark"] != new["benchmark"]:
+        parser.error(f"different benchmarks: {base['benchmark']} vs {new['benchmark']}")
+    for label, doc in (("base", base), ("new", new)):
+        git = doc.get("git") or {}
+        print(f"{label}: {git.get('commit')}{' (dirty)' if git.get('dirty') else ''} on "
+              f"{doc['machine'].get('platform')}, {doc['machine'].get('cpu_count')} CPUs")
+    if base["machine"].get("platform") != new["machine"].get("platform"):
+        print("warning: results come from different machines")
+
+    regressions = []
+    for key in sorted(set(base["results"]) | set(new["results"])):
+        old, cur = base["results"].get(key), new["results"].get(key)
+        if old is None or cur is None:
+            print(f"{key:<48} only in {'new' if old is None else 'base'}")
+            continue
+        cells = []
+        for metric, higher_is_better in METRICS.items():
+            if metric not in old or metric not in cur:
+                continue
+            pct = change(old[metric], cur[metric], higher_is_better)
+            flag = "!" if pct > args.threshold else " "
+            cells.append(f"{metric}={old[metric]:.2f}->{cur[metric]:.2f} ({pct:+.1f}%){flag}")
+            if pct > args.threshold:
+                regressions.append((key, metric, pct))
+        print(f"{key:<48} {'  '.join(cells)}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0f}%:")
+        for key, metric, pct in regressions:
+            print(f"  {key} {metric} {pct:+.1f}%")
+        sys.exit(1)
+    print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
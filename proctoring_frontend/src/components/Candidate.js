@@ -1,10 +1,15 @@
 import React, { useEffect, useRef, useState } from "react";
 
+const API_URL = "http://localhost:8000";
+const RECORDING_TIMESLICE_MS = 5000; // one upload chunk every 5s of recording
+const UPLOAD_RETRIES = 5;
+const CAPTURE_INTERVAL_MS = 2000; // until the server suggests another interval
+const MAX_CAPTURE_INTERVAL_MS = 30000; // back-off cap when the server cannot be reached
+
 const Candidate = ({ candidateId , candidateName }) => {
   const videoRef = useRef(null);
   const mediaRecorderRef = useRef(null);
   const [recording, setRecording] = useState(false);
-  const [recordedChunks, setRecordedChunks] = useState([]);
 
   useEffect(() => {
     let stream;
@@ -13,52 +18,131 @@ const Candidate = ({ candidateId , candidateName }) => {
       videoRef.current.srcObject = stream;
     });
 
-    // Send frame every 2s
-    const interval = setInterval(captureAndSend, 2000);
+    // Send a frame, then wait as long as the server asks before the next one
+    // (longer when it is loaded), so at most one frame is in flight
+    let timer;
+    let stopped = false;
+    const loop = async (delay) => {
+      const next = await captureAndSend(delay);
+      if (!stopped) timer = setTimeout(loop, next, next);
+    };
+    timer = setTimeout(loop, CAPTURE_INTERVAL_MS, CAPTURE_INTERVAL_MS);
 
     return () => {
-      clearInterval(interval);
+      stopped = true;
+      clearTimeout(timer);
       if (stream) {
         stream.getTracks().forEach((track) => track.stop());
       }
     };
   }, []);
 
-  const captureAndSend = async () => {
-    if (!videoRef.current) return;
+  // Returns the delay before the next capture
+  const captureAndSend = async (delay) => {
+    if (!videoRef.current || !videoRef.current.videoWidth) return delay;
 
     const canvas = document.createElement("canvas");
     canvas.width = videoRef.current.videoWidth;
     canvas.height = videoRef.current.videoHeight;
     const ctx = canvas.getContext("2d");
     ctx.drawImage(videoRef.current, 0, 0, canvas.width, canvas.height);
-    const dataURL = canvas.toDataURL("image/jpeg");
+    // Send the JPEG as raw bytes (no base64 / JSON wrapping)
+    const blob = await new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg"));
+    if (!blob) return delay;
 
     try {
-      const res = await fetch("http://localhost:8000/analyze", {
+      const res = await fetch(`${API_URL}/analyze/raw?candidate_id=${encodeURIComponent(candidateId)}`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ candidate_id: candidateId, frame: dataURL }),
+        headers: { "Content-Type": "application/octet-stream" },
+        body: blob,
       });
+      // Accepted and dropped frames (429/503) both carry the server's hint
+      const { next_interval_ms: hint } = await res.json().catch(() => ({}));
+      if (hint > 0) return hint;
       if (!res.ok) {
         throw new Error("Server error: " + res.status);
       }
+      return CAPTURE_INTERVAL_MS;
     } catch (err) {
-      // Optionally handle error
+      // Unreachable or failing server: back off instead of retrying at full rate
+      return Math.min(delay * 2, MAX_CAPTURE_INTERVAL_MS);
+    }
+  };
+
+  // Upload the recording while it is being made: each MediaRecorder timeslice
+  // is appended to a resumable upload session, one chunk at a time.
+  const appendChunk = async (upload, blob) => {
+    const body = await blob.arrayBuffer();
+    const digest = await window.crypto.subtle.digest("SHA-256", body);
+    const sha256 = Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, "0")).join("");
+
+    for (let attempt = 0; attempt < UPLOAD_RETRIES; attempt++) {
+      try {
+        const res = await fetch(`${API_URL}/uploads/${upload.id}?offset=${upload.offset}`, {
+          method: "PUT",
+          headers: { "Content-Type": "application/octet-stream", "X-Chunk-SHA256": sha256 },
+          body,
+        });
+        if (res.ok) {
+          upload.offset = (await res.json()).offset;
+          return;
+        }
+        if (res.status === 409) {
+          // The server already has this chunk (e.g. the response was lost): skip it
+          const { offset } = await res.json();
+          if (offset === upload.offset + body.byteLength) {
+            upload.offset = offset;
+            return;
+          }
+        }
+      } catch (err) {
+        // network error: retry below
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
     }
+    throw new Error("Failed to upload video chunk");
   };
 
-  const startRecording = () => {
+  const startRecording = async () => {
     const stream = videoRef.current.srcObject;
+    let upload;
+    try {
+      const res = await fetch(`${API_URL}/uploads`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ candidate_id: candidateId, filename: `${candidateId}_video.webm` }),
+      });
+      if (!res.ok) throw new Error("Failed to start upload");
+      upload = { id: (await res.json()).upload_id, offset: 0, queue: Promise.resolve() };
+    } catch (err) {
+      alert("Error uploading video: " + err.message);
+      return;
+    }
+
     const mediaRecorder = new window.MediaRecorder(stream, { mimeType: "video/webm" });
     mediaRecorderRef.current = mediaRecorder;
-    setRecordedChunks([]);
     mediaRecorder.ondataavailable = (e) => {
       if (e.data.size > 0) {
-        setRecordedChunks((prev) => [...prev, e.data]);
+        upload.queue = upload.queue.then(() => appendChunk(upload, e.data));
       }
     };
-    mediaRecorder.start();
+    mediaRecorder.onstop = () => {
+      upload.queue
+        .then(() =>
+          fetch(`${API_URL}/uploads/${upload.id}/finalize`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ size: upload.offset }),
+          })
+        )
+        .then((res) => {
+          if (!res.ok) throw new Error("Failed to upload video");
+        })
+        .catch((err) => {
+          alert("Error uploading video: " + err.message);
+        });
+    };
+    mediaRecorder.start(RECORDING_TIMESLICE_MS);
     setRecording(true);
   };
 
@@ -70,27 +154,6 @@ const Candidate = ({ candidateId , candidateName }) => {
     }
   };
 
-  useEffect(() => {
-    if (!recording && recordedChunks.length > 0) {
-      // Upload video to backend
-      const blob = new Blob(recordedChunks, { type: "video/webm" });
-      const formData = new FormData();
-      formData.append("video", blob, `${candidateId}_video.webm`);
-      formData.append("candidate_id", candidateId);
-      fetch("http://localhost:8000/upload_video", {
-        method: "POST",
-        body: formData,
-      })
-        .then((res) => {
-          if (!res.ok) throw new Error("Failed to upload video");
-        })
-        .catch((err) => {
-          alert("Error uploading video: " + err.message);
-        });
-    }
-    // eslint-disable-next-line
-  }, [recording]);
-
   return (
     <div className="candidate-container">
       <h2 className="candidate-title">Candidate Screen - {candidateName}</h2>
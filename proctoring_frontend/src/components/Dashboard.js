@@ -1,29 +1,78 @@
 import React, { useEffect, useState } from "react";
 
+const API_URL = "http://localhost:8000";
+
 const Dashboard = ({ candidateId , candidateName }) => {
   const [logs, setLogs] = useState([]);
 
   useEffect(() => {
-    const interval = setInterval(fetchLogs, 3000); // poll every 3s
-    return () => clearInterval(interval);
-  }, []);
+    // Events by id: episodes are re-sent as they grow, so merge instead of append
+    const byId = new Map();
+    let cursor = null;
+    let etag = null;
+    let source = null;
+    let interval = null;
+    let cancelled = false;
 
-  const fetchLogs = async () => {
-    try {
-      const res = await fetch(`http://localhost:8000/logs/${candidateId}`);
-      if (!res.ok) {
-        throw new Error("Server error: " + res.status);
+    const merge = (events) => {
+      events.forEach((ev) => byId.set(ev.id, ev));
+      const sorted = Array.from(byId.values()).sort((a, b) => (a.timestamp < b.timestamp ? 1 : -1));
+      setLogs(sorted.slice(0, 100));
+    };
+
+    // Fallback: poll only for changes since the last cursor; 304 when nothing changed
+    const fetchLogs = async () => {
+      try {
+        const url = cursor
+          ? `${API_URL}/logs/${candidateId}?since=${encodeURIComponent(cursor)}`
+          : `${API_URL}/logs/${candidateId}`;
+        const res = await fetch(url, { headers: etag ? { "If-None-Match": etag } : {} });
+        if (res.status === 304) return;
+        if (!res.ok) {
+          throw new Error("Server error: " + res.status);
+        }
+        etag = res.headers.get("ETag");
+        const data = await res.json();
+        cursor = data.cursor;
+        merge(data.events || []);
+      } catch (err) {
+        alert("Error fetching logs: " + err.message);
       }
-      const data = await res.json();
-      setLogs(data.events || []);
-    } catch (err) {
-      alert("Error fetching logs: " + err.message);
-    }
-  };
+    };
+
+    const startPolling = () => {
+      if (!interval) interval = setInterval(fetchLogs, 3000); // poll every 3s
+    };
+
+    // Initial page, then live updates pushed by the server (Server-Sent Events)
+    fetchLogs().then(() => {
+      if (cancelled) return;
+      if (!window.EventSource) {
+        startPolling();
+        return;
+      }
+      source = new EventSource(`${API_URL}/logs/${candidateId}/stream?since=${encodeURIComponent(cursor || "")}`);
+      source.addEventListener("events", (e) => {
+        const data = JSON.parse(e.data);
+        cursor = data.cursor;
+        merge(data.events || []);
+      });
+      source.onerror = () => {
+        // EventSource reconnects by itself; only fall back once it gives up
+        if (source.readyState === EventSource.CLOSED) startPolling();
+      };
+    });
+
+    return () => {
+      cancelled = true;
+      if (source) source.close();
+      if (interval) clearInterval(interval);
+    };
+  }, [candidateId]);
 
   const handleDownloadReport = async () => {
     try {
-      const res = await fetch(`http://localhost:8000/report/${candidateId}`);
+      const res = await fetch(`${API_URL}/report/${candidateId}`);
       if (!res.ok) throw new Error("Failed to download report");
       const blob = await res.blob();
       const url = window.URL.createObjectURL(blob);
@@ -51,14 +100,16 @@ const Dashboard = ({ candidateId , candidateName }) => {
             <th>Time</th>
             <th>Type</th>
             <th>Details</th>
+            <th>Duration</th>
           </tr>
         </thead>
         <tbody>
           {logs.map((log, i) => (
-            <tr key={i}>
+            <tr key={log.episode_id || i}>
               <td>{log.timestamp}</td>
               <td>{log.type}</td>
               <td>{log.details}</td>
+              <td>{log.duration != null ? `${log.duration.toFixed(1)}s${log.status === "closed" ? "" : " (ongoing)"}` : ""}</td>
             </tr>
           ))}
         </tbody>